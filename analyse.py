@@ -55,11 +55,7 @@ labels = {
 
 
 def cal_lc_coverage(pred_df, label_num, cover_k):
-    current_combinations = BitSet(
-        int(comb(label_num, cover_k) * pow(2, cover_k)),
-        cover_k,
-        {cb: idx for idx, cb in enumerate(combinations(range(label_num), cover_k))}
-    )
+    current_combinations = BitSet(int(comb(label_num, cover_k) * pow(2, cover_k)), cover_k)
     tmp_df = pred_df.copy()
     tmp_df["combinations"] = None
     coverage, cover_lc, all_lc, _ = calculate_coverage(tmp_df, label_num, cover_k, current_combinations)
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import contextlib
+import multiprocessing as mp
+import argparse
+import numpy as np
+import pandas as pd
+from ca_generator import get_covering_array
+from run_acts import write_args, acts_command, parse_acts_output
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+benchmark_dir = os.path.join("data", "lvcit", "benchmark")
+KEY_COLUMNS = ["n", "k", "tau", "method", "seed"]
+
+
+def benchmark_matrix(name="quick"):
+    """
+    the fixed matrix of (n, k, tau, method, seed) to run
+
+    :param name: quick (a few minutes) or full (the settings of the paper and tau=3)
+    :return: list of (n, k, tau, method, seed)
+    """
+    methods = ["baseline", "adaptive random", "greedy"]
+    if name == "quick":
+        return [(n, k, 2, method, seed) for method in methods for n in [20, 80] for k in [2, 4, 6] for seed in range(3)] + \
+            [(20, k, 3, method, 0) for method in methods for k in [3, 4]]
+    if name == "full":
+        return [(n, k, 2, method, seed) for method in methods + ["acts"] for n in [20, 80] for k in range(2, 7) for seed in range(5)] + \
+            [(n, k, 3, method, seed) for method in methods for n in [20, 40] for k in range(3, 7) for seed in range(3)]
+    raise Exception(f"unknown benchmark matrix: {name}")
+
+
+def peak_rss(children=False):
+    """
+    :return: peak resident set size of the current process (or its terminated children) in MB, None if unknown
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def run_acts_case(n, k, tau, seed, jar):
+    """
+    run ACTS once, the seed only names the output files since ACTS takes no seed
+    """
+    work_dir = os.path.join(benchmark_dir, "acts")
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    args_file = os.path.join(work_dir, f"args_{n}_{k}.txt")
+    write_args(n, k, args_file)
+    output_file = os.path.join(work_dir, f"ca_acts_{n}_{k}_{tau}_{seed}.csv")
+    cpu_start = resource.getrusage(resource.RUSAGE_CHILDREN) if resource else None
+    start = time.perf_counter()
+    process = subprocess.run(acts_command(args_file, output_file, tau, jar), capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise Exception(f"ACTS failed: {process.stderr.strip()}")
+    size, acts_time = parse_acts_output(process.stdout.strip())
+    cpu = None
+    if resource:
+        cpu_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = cpu_end.ru_utime + cpu_end.ru_stime - cpu_start.ru_utime - cpu_start.ru_stime
+    return {
+        "size": int(size), "coverage": 1.0, "wall": wall, "cpu": cpu, "peak_rss": peak_rss(children=True),
+        "generation": float(acts_time), "reduction": None,
+    }
+
+
+def run_case(case, jar="acts_3.2.jar"):
+    """
+    run one case of the matrix, it is meant to be called in a fresh process so that the peak RSS is its own
+
+    :param case: (n, k, tau, method, seed)
+    :return: record of the case
+    """
+    n, k, tau, method, seed = case
+    record = dict(zip(KEY_COLUMNS, [n, k, tau, method, seed]))
+    if method == "acts":
+        record.update(run_acts_case(n, k, tau, seed, jar))
+        return record
+    timings = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        array, coverage = get_covering_array(method, n, k, tau, seed=seed, timings=timings)
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    record.update({
+        "size": len(array), "coverage": coverage, "wall": wall, "cpu": cpu, "peak_rss": peak_rss(),
+        "generation": timings["generation"], "reduction": timings["reduction"],
+    })
+    return record
+
+
+def run_benchmark(cases, repeat=1, jar="acts_3.2.jar"):
+    """
+    run every case in its own process, one after another so that the timings do not disturb each other, the
+    ACTS cases are skipped if the jar file does not exist
+
+    :param repeat: number of runs of every case, the one with the least wall time is kept
+    :return: DataFrame of the records
+    """
+    if not os.path.exists(jar) and any(case[3] == "acts" for case in cases):
+        print(f"{jar} not found, skip ACTS")
+        cases = [case for case in cases if case[3] != "acts"]
+    records = []
+    with mp.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        for i, case in enumerate(cases):
+            runs = [pool.apply(run_case, (case, jar)) for _ in range(repeat)]
+            records.append(min(runs, key=lambda r: r["wall"]))
+            print(f"\r{i + 1}/{len(cases)} {case}: size {records[-1]['size']}, wall {records[-1]['wall']:.3f}s", end="")
+    print("")
+    return pd.DataFrame(records)
+
+
+def save_results(results: pd.DataFrame, path, matrix):
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    info = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "matrix": matrix,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+    with open(path, "w") as f:
+        json.dump({"info": info, "results": json.loads(results.to_json(orient="records"))}, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return pd.DataFrame(json.load(f)["results"])
+
+
+def compare(results: pd.DataFrame, baseline: pd.DataFrame, tolerance=0.2, min_time=0.05):
+    """
+    compare the results with the baseline, a case regresses if its array is larger, or its wall time or peak RSS
+    grows by more than the tolerance (wall time differences under min_time seconds are ignored as noise)
+
+    :return: merged DataFrame with the ratios and a regression column
+    """
+    merged = results.merge(baseline, on=KEY_COLUMNS, how="inner", suffixes=("", "_base"))
+    merged["wall_ratio"] = merged["wall"] / merged["wall_base"]
+    merged["rss_ratio"] = merged["peak_rss"] / merged["peak_rss_base"]
+    slower = (merged["wall_ratio"] > 1 + tolerance) & (merged["wall"] - merged["wall_base"] > min_time)
+    larger = merged["size"] > merged["size_base"]
+    heavier = merged["rss_ratio"] > 1 + tolerance
+    merged["regression"] = [
+        ",".join(name for name, flag in zip(["time", "size", "rss"], flags) if flag)
+        for flags in zip(slower, larger, heavier)
+    ]
+    return merged
+
+
+if __name__ == '__main__':
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', 1000)
+
+    parser = argparse.ArgumentParser(description="Benchmark covering array generation")
+    parser.add_argument("--matrix", "-m", type=str, default="quick", help="quick or full, default quick")
+    parser.add_argument("--repeat", "-r", type=int, default=1, help="runs of every case, the fastest is kept")
+    parser.add_argument(
+        "--output", "-o", type=str, default=os.path.join(benchmark_dir, "results.json"), help="results file"
+    )
+    parser.add_argument(
+        "--baseline", "-b", type=str, default=os.path.join(benchmark_dir, "baseline.json"),
+        help="baseline results file to compare with"
+    )
+    parser.add_argument("--save_baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", "-t", type=float, default=0.2, help="tolerated relative growth, default 0.2")
+    parser.add_argument("--jar", type=str, default="acts_3.2.jar", help="path of the ACTS jar file")
+    args = parser.parse_args()
+
+    results = run_benchmark(benchmark_matrix(args.matrix), args.repeat, args.jar)
+    save_results(results, args.output, args.matrix)
+    summary = results.groupby(["n", "tau", "method"])[["size", "wall", "cpu", "peak_rss", "generation", "reduction"]].mean()
+    print(summary)
+    if args.save_baseline:
+        save_results(results, args.baseline, args.matrix)
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        merged = compare(results, load_results(args.baseline), args.tolerance)
+        regressions = merged[merged["regression"] != ""]
+        print(merged[KEY_COLUMNS + ["size", "size_base", "wall", "wall_base", "wall_ratio", "rss_ratio", "regression"]])
+        if len(regressions):
+            print(f"{len(regressions)} regressions")
+            sys.exit(1)
+        print("no regressions")
+    else:
+        print(f"no baseline found at {args.baseline}, run with --save_baseline to create one")
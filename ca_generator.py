@@ -1,28 +1,164 @@
+import csv
+import glob
+import hashlib
+import json
 import math
 import os
-import random
 import sys
 import time
+import zlib
+import contextlib
 import numpy as np
 import pandas as pd
 from pandas import DataFrame
 from itertools import combinations
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from scipy.special import comb
 import argparse
 from util import str2bool
 
 
 output_dir = os.path.join("data", "lvcit", "1covering_array")
-np.random.seed(int(time.time()))
-random.seed(int(time.time()))
+SPARSE_TAU = 3  # covering strength from which SparseCoverage is used
+MANIFEST_COLUMNS = ["method", "n", "k", "tau", "thr", "seed", "size", "time", "coverage", "file"]
+
+
+class Profiler:
+    """
+    named timers and counters of a generation run, disabled by default, then timer returns a shared no-op context
+    and count returns at once, so that the hooks can stay in the hot loops
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.timers = {}  # name -> [total seconds, calls]
+        self.counters = {}
+
+    def reset(self, enabled=True):
+        self.enabled = enabled
+        self.timers = {}
+        self.counters = {}
+
+    def timer(self, name):
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self.timers.setdefault(name, [0.0, 0]))
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        return {
+            "timers": {name: {"total": total, "calls": calls} for name, (total, calls) in self.timers.items()},
+            "counters": dict(self.counters),
+        }
+
+    def save(self, path, **info):
+        """
+        save the report as json, with the given info (e.g. parameters of the run) under the key "run"
+        """
+        with open(path, "w") as f:
+            json.dump({"run": info, **self.report()}, f, indent=2, default=str)
+
+
+class _Timer:
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.slot[0] += time.perf_counter() - self.start
+        self.slot[1] += 1
+
+
+_NO_TIMER = contextlib.nullcontext()
+profiler = Profiler()
+
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """
+    number of set bits in an array of uint64 words
+    """
+    return int(_POPCOUNT[np.ascontiguousarray(words).astype("<u8", copy=False).view(np.uint8)].sum(dtype=np.int64))
+
+
+@lru_cache(maxsize=None)
+def binom_table(n, tau):
+    """
+    binomial coefficients C(i, j) for 0 <= i <= n and 0 <= j <= tau
+
+    :param n: largest top value
+    :param tau: largest bottom value
+    :return: int64 array with shape (n + 1, tau + 1)
+    """
+    table = np.zeros((n + 1, tau + 1), dtype=np.int64)
+    table[:, 0] = 1
+    for i in range(1, n + 1):
+        table[i, 1:] = table[i - 1, 1:] + table[i - 1, :-1]
+    table.flags.writeable = False
+    return table
+
+
+def comb_rank(indexes):
+    """
+    colex rank of a tau-combination in the combinatorial number system, i.e. sum of C(c_i, i + 1) over the sorted indexes
+
+    :param indexes: indexes of the combination, e.g. (0, 3, 5)
+    :return: rank in [0, C(n, tau))
+    """
+    indexes = sorted(indexes)
+    if not indexes:
+        return 0
+    table = binom_table(indexes[-1], len(indexes))
+    return int(sum(table[c, i + 1] for i, c in enumerate(indexes)))
+
+
+@lru_cache(maxsize=None)
+def comb_table(n, tau):
+    """
+    all tau-combinations of range(n), row r holds the combination whose colex rank is r
+
+    :param n: number of labels
+    :param tau: covering strength
+    :return: int64 array with shape (C(n, tau), tau)
+    """
+    combs = list(combinations(range(n), tau))
+    combs = np.array(combs, dtype=np.int64).reshape(len(combs), tau)
+    ranks = binom_table(n, tau)[combs, np.arange(1, tau + 1)].sum(axis=1)
+    table = np.empty_like(combs)
+    table[ranks] = combs
+    table.flags.writeable = False
+    return table
+
+
+def rank_rows(rows, tau):
+    """
+    bit index of the tau-way combination covered by every tau-subset of every row, the bit index of the
+    combination (c_1 < ... < c_tau) with values (v_1, ..., v_tau) is rank * 2^tau + (v_1 v_2 ... v_tau)_2
+
+    :param rows: 0/1 row with shape (n,) or rows with shape (m, n)
+    :param tau: covering strength
+    :return: int64 array with shape (C(n, tau),) or (m, C(n, tau))
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    combs = comb_table(rows.shape[-1], tau)
+    weights = 1 << np.arange(tau - 1, -1, -1, dtype=np.int64)
+    offsets = rows[..., combs] @ weights
+    return (np.arange(len(combs), dtype=np.int64) << tau) + offsets
 
 
 class BitSet:
-    def __init__(self, size, k, comb2idx, values=None):
+    def __init__(self, size, k, values=None):
         self.size = size
         self.k = k
-        self.comb2idx = comb2idx
-        self.data = bytearray(size // 8 + 1)
+        self.data = np.zeros((size + 63) // 64, dtype=np.uint64)
         if values is not None:
             self.init(values)
 
@@ -30,144 +166,765 @@ class BitSet:
         if key >= self.size:
             raise IndexError(f"index out of range: get index {key}, max index {self.size - 1}")
         if value == 1:
-            self.data[key // 8] |= 1 << (key % 8)
+            self.data[key >> 6] |= np.uint64(1) << np.uint64(key & 63)
         elif value == 0:
-            self.data[key // 8] &= ~(1 << (key % 8))
+            self.data[key >> 6] &= ~(np.uint64(1) << np.uint64(key & 63))
         else:
             raise ValueError("value must be 0 or 1")
 
     def __getitem__(self, key):
         if key >= self.size:
             raise IndexError(f"index out of range: get index {key}, max index {self.size - 1}")
-        return (self.data[key // 8] >> (key % 8)) & 1
+        return int(self.data[key >> 6] >> np.uint64(key & 63)) & 1
 
     def __str__(self):
-        return "".join([str(self[i]) for i in range(self.size)])
+        return "".join(map(str, self.bits()))
 
     def __len__(self):
-        return sum([self[i] for i in range(self.size)])
+        return popcount(self.data)
+
+    def bytes(self):
+        """
+        little-endian byte view of the words, bit i of the set is bit i % 8 of byte i // 8
+        """
+        return self.data.astype("<u8", copy=False).view(np.uint8)
+
+    def bits(self):
+        return np.unpackbits(self.bytes(), bitorder="little")[:self.size]
 
     def copy(self):
-        tmp = BitSet(self.size, self.k, self.comb2idx)
-        tmp.update(self)
+        tmp = BitSet(self.size, self.k)
+        tmp.data = self.data.copy()
         return tmp
 
     def update(self, other):
         if self.size != other.size:
             raise ValueError("size must be equal")
-        for i in range(self.size // 8 + 1):
-            self.data[i] |= other.data[i]
+        np.bitwise_or(self.data, other.data, out=self.data)
 
     def clear(self):
-        self.data = bytearray(self.size // 8 + 1)
+        self.data = np.zeros_like(self.data)
+        return self
+
+    def set_indices(self, indices):
+        """
+        set all the given bit indices to 1 at once
+
+        :param indices: array-like of bit indices
+        """
+        indices = np.asarray(indices, dtype=np.uint64)
+        if len(indices) == 0:
+            return self
+        if int(indices.max()) >= self.size:
+            raise IndexError(f"index out of range: get index {int(indices.max())}, max index {self.size - 1}")
+        np.bitwise_or.at(self.data, indices >> np.uint64(6), np.uint64(1) << (indices & np.uint64(63)))
         return self
 
+    def test_indices(self, indices):
+        """
+        test all the given bit indices at once
+
+        :param indices: array-like of bit indices
+        :return: uint64 array of 0/1 values
+        """
+        indices = np.asarray(indices, dtype=np.uint64)
+        return (self.data[indices >> np.uint64(6)] >> (indices & np.uint64(63))) & np.uint64(1)
+
     def init(self, values):
-        for value in values:
-            offset = 0
-            for v in sorted(value):
-                offset = offset * 2 + v[1]
-            idx = self.comb2idx[tuple([v[0] for v in sorted(value)])] * pow(2, self.k) + offset
-            self[idx] = 1
+        """
+        set the tau-way combinations covered by the given 0/1 row(s)
 
-    @staticmethod
-    def union(bitsets):
-        tmp = bitsets[0].copy()
-        for bitset in bitsets[1:]:
-            tmp.update(bitset)
-        return tmp
+        :param values: a row with shape (n,) or rows with shape (m, n)
+        """
+        self.set_indices(rank_rows(values, self.k).ravel())
 
 
-def calculate_coverage(array: DataFrame, label, tau, current_combinations=None, is_del=False, del_idx=0):
+def calculate_coverage(array: DataFrame, label, tau, current_combinations=None):
     """
-    Calculate the k-dimensional coverage of the current array
+    Calculate the k-dimensional coverage of the current array, the rows without a BitSet in the combinations column
+    get one and all of them are added to current_combinations
 
     :param array: current covering array
     :param label: number of labels
     :param tau: covering strength
-    :param current_combinations: the combinations that have been covered, type is dict if is_del is False else set
-    :param is_del: calculate the coverage when removing rows from the array if true
-    :param del_idx: the index of the row to be removed
+    :param current_combinations: BitSet of the combinations that have been covered
     :return: coverage, number of tau-way combinations already covered, number of tau-way combinations, current_combinations
     """
-    if is_del:
-        del_key = None
-        for key in current_combinations.keys():
-            if key[0] <= del_idx < key[1]:
-                del_key = key
-                break
-        current_combinations = {key: val if key != del_key else val.copy().clear() for key, val in current_combinations.items()}
-        array.loc[(array.index >= del_key[0]) & (array.index < del_key[1]), "combinations"].apply(
-            lambda x: current_combinations[del_key].update(x)
-        )
-        t_i = len(BitSet.union(list(current_combinations.values())))
-    else:
-        array["combinations"] = array[pd.isna(array["combinations"])].apply(
-            lambda x: BitSet(
-                current_combinations.size,
-                current_combinations.k,
-                current_combinations.comb2idx,
-                combinations(enumerate(x[list(range(label))]), tau)
-            ), axis=1
-        )
-        array["combinations"].apply(
-            lambda x: current_combinations.update(x)
-        )
-        t_i = len(current_combinations)
+    array["combinations"] = array[pd.isna(array["combinations"])].apply(
+        lambda x: BitSet(
+            current_combinations.size,
+            current_combinations.k,
+            x[list(range(label))].values.astype(np.uint8)
+        ), axis=1
+    )
+    array["combinations"].apply(
+        lambda x: current_combinations.update(x)
+    )
+    t_i = len(current_combinations)
     sut_i = int(comb(label, tau) * pow(2, tau))
     cov = t_i / sut_i
     return cov, t_i, sut_i, current_combinations
 
 
-def add_lines_baseline(array: DataFrame, label, tau):
+class Constraints:
+    """
+    constraints on the rows of a covering array besides the counting constraint, a tau-way combination is valid
+    iff the closure of its 1 values under the implications is a valid row that keeps its 0 values, only valid
+    combinations are counted in sut_i
+
+    :param label: number of labels
+    :param k: the counting constraint value, at most k labels in a row, default no limit
+    :param forbidden: label sets that never appear together in a row, e.g. label pairs with no objects to composite
+    :param implies: (a, b) pairs, every row containing label a must contain label b as well
+    :param min_freq: {label: minimum number of rows containing the label}
+    :param max_freq: {label: maximum number of rows containing the label}, once reached, the combinations with
+    the label that are still uncovered are no longer counted
+    """
+
+    def __init__(self, label, k=None, forbidden=(), implies=(), min_freq=None, max_freq=None):
+        self.label = label
+        self.k = label if k is None else k
+        self.forbidden = [sorted({int(i) for i in labels}) for labels in forbidden]
+        self.implies = [(int(a), int(b)) for a, b in implies]
+        self.min_freq = np.zeros(label, dtype=np.int64)
+        self.max_freq = np.full(label, np.iinfo(np.int64).max, dtype=np.int64)
+        for freq, values in [(self.min_freq, min_freq or {}), (self.max_freq, max_freq or {})]:
+            for i, value in values.items():
+                freq[self._check(i)] = value
+        for i in [i for labels in self.forbidden for i in labels] + [i for pair in self.implies for i in pair]:
+            self._check(i)
+
+        self.forbidden_matrix = np.zeros((len(self.forbidden), label), dtype=np.float32)
+        for row, labels in zip(self.forbidden_matrix, self.forbidden):
+            row[labels] = 1
+        self.forbidden_size = self.forbidden_matrix.sum(axis=1)
+        # transitive closure of the implications, reach[a, b] is True iff a row containing a must contain b
+        self.reach = np.eye(label, dtype=bool)
+        for a, b in self.implies:
+            self.reach[a, b] = True
+        for i in range(label):
+            self.reach |= self.reach[:, i:i + 1] & self.reach[i]
+
+    def _check(self, i):
+        i = int(i)
+        if not 0 <= i < self.label:
+            raise Exception(f"label out of range: get {i}, number of labels {self.label}")
+        return i
+
+    @staticmethod
+    def load(path, label, k=None):
+        """
+        read constraints from a json file with the optional keys forbidden, implies, min_freq and max_freq, e.g.
+        {"forbidden": [[0, 3]], "implies": [[5, 1]], "min_freq": {"2": 3}, "max_freq": {"4": 10}}
+        """
+        with open(path) as f:
+            return Constraints(label, k, **json.load(f))
+
+    @staticmethod
+    def store_name(path):
+        """
+        :return: name of the store of the arrays under the constraints of a json file, the file name and a hash of
+        the constraints, so that the arrays generated before the file was edited are not reused
+        """
+        with open(path) as f:
+            rules = json.load(f)
+        digest = hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:12]
+        return f"{os.path.splitext(os.path.basename(path))[0]}_{digest}"
+
+    def close(self, lines):
+        """
+        add the labels implied by the labels of each row
+
+        :param lines: rows with shape (m, n)
+        :return: closed rows with shape (m, n)
+        """
+        lines = np.asarray(lines, dtype=np.uint8)
+        if not self.implies:
+            return lines
+        return (lines.astype(np.float32) @ self.reach.astype(np.float32) > 0).astype(np.uint8)
+
+    def valid(self, lines):
+        """
+        :param lines: rows with shape (m, n)
+        :return: bool array with shape (m,), whether each row satisfies the counting constraint, the forbidden
+        label sets and the implications
+        """
+        lines = np.asarray(lines, dtype=np.uint8)
+        ok = lines.sum(axis=1) <= self.k
+        if self.forbidden:
+            ok &= ~(lines.astype(np.float32) @ self.forbidden_matrix.T >= self.forbidden_size).any(axis=1)
+        if self.implies:
+            a, b = np.array(self.implies).T
+            ok &= ~((lines[:, a] == 1) & (lines[:, b] == 0)).any(axis=1)
+        return ok
+
+    def exhausted(self, label_count):
+        """
+        :return: bool array with shape (n,), whether each label has reached its maximum frequency
+        """
+        return label_count >= self.max_freq
+
+    def allowed(self, lines, label_count):
+        """
+        :return: bool array with shape (m,), whether each row can be added to an array with the given label counts
+        """
+        lines = np.asarray(lines, dtype=np.uint8)
+        return self.valid(lines) & ~(lines.astype(bool) & self.exhausted(label_count)).any(axis=1)
+
+    def removable(self, line, label_count):
+        """
+        :return: whether the row can be removed without breaking the minimum frequencies
+        """
+        return bool((label_count - line >= self.min_freq)[line == 1].all())
+
+    def sets(self, j, chunk_size=65536):
+        """
+        the j-subsets of labels as the 1 values of combinations
+
+        :return: bool array with shape (C(n, j),), whether the closure of each subset (by colex rank) is a valid
+        row, and int64 array with shape (C(n, j),), number of labels outside the closure
+        """
+        table = comb_table(self.label, j)
+        valid = np.empty(len(table), dtype=bool)
+        free = np.empty(len(table), dtype=np.int64)
+        for i in range(0, len(table), chunk_size):
+            lines = np.zeros((len(table[i:i + chunk_size]), self.label), dtype=np.uint8)
+            lines[np.arange(len(lines))[:, None], table[i:i + chunk_size]] = 1
+            lines = self.close(lines)
+            valid[i:i + chunk_size] = self.valid(lines)
+            free[i:i + chunk_size] = self.label - lines.sum(axis=1)
+        return valid, free
+
+    def tuples(self, tau):
+        """
+        :return: bool array with shape (C(n, tau) * 2^tau,), whether each tau-way combination (by bit index, see
+        rank_rows) is valid
+        """
+        table = comb_table(self.label, tau)
+        index = np.arange(len(table) << tau, dtype=np.int64)
+        labels = table[index >> tau]
+        values = (index[:, None] >> np.arange(tau - 1, -1, -1)) & 1
+        lines = np.zeros((len(index), self.label), dtype=np.uint8)
+        lines[index[:, None], labels] = values
+        lines = self.close(lines)
+        return self.valid(lines) & ~((lines[index[:, None], labels] == 1) & (values == 0)).any(axis=1)
+
+    def implied_by(self, i):
+        """
+        :return: bool array with shape (n,), whether each label implies label i
+        """
+        return self.reach[:, i]
+
+
+def count_merges(name, rows, label, tau):
+    """
+    count the rows and their tau-way combinations (C(n, tau) per row) merged into, scored against or removed from a
+    coverage multiset
+    """
+    if profiler.enabled:
+        profiler.count(f"rows {name}", rows)
+        profiler.count(f"combinations {name}", rows * math.comb(label, tau))
+
+
+class CoverageCounter:
+    """
+    multiset of the covered tau-way combinations, it keeps one uint16 count per combination so that removing a
+    row is a vectorized decrement, counts saturate at 65535, every row is ranked over all its C(n, tau)
+    combinations (see rank_rows), which suits low strengths
+    """
+
+    def __init__(self, label, tau, rows=None, constraints: Constraints = None):
+        self.label = label
+        self.tau = tau
+        self.constraints = constraints or Constraints(label)
+        self.valid = self.constraints.tuples(tau)
+        self.size = int(np.count_nonzero(self.valid))
+        self.counts = np.zeros(len(self.valid), dtype=np.uint16)
+        self.t_i = 0
+        if rows is not None:
+            self.add(rows)
+
+    def __len__(self):
+        return self.t_i
+
+    def add(self, rows, chunk_size=256):
+        """
+        add the combinations of all rows, ranked chunk by chunk
+
+        :param rows: 0/1 row with shape (n,) or rows with shape (m, n)
+        """
+        rows = np.asarray(rows, dtype=np.uint8).reshape(-1, self.label)
+        count_merges("merged", len(rows), self.label, self.tau)
+        counts = self.counts.astype(np.int64)
+        for i in range(0, len(rows), chunk_size):
+            counts += np.bincount(rank_rows(rows[i:i + chunk_size], self.tau).ravel(), minlength=len(counts))
+        self.counts = np.minimum(counts, np.iinfo(np.uint16).max).astype(np.uint16)
+        self.t_i = int(np.count_nonzero(self.counts))
+
+    def gain(self, lines):
+        """
+        :param lines: candidate rows with shape (m, n)
+        :return: number of uncovered combinations each candidate row would cover
+        """
+        count_merges("scored", len(lines), self.label, self.tau)
+        return (self.counts[rank_rows(lines, self.tau)] == 0).sum(axis=-1)
+
+    def lost(self, line):
+        """
+        :param line: a row in the array
+        :return: number of combinations that would be no longer covered if the row was removed
+        """
+        return int(np.count_nonzero(self.counts[rank_rows(line, self.tau)] == 1))
+
+    def remove(self, line):
+        """
+        remove a row in the array from the multiset
+        """
+        count_merges("removed from coverage", 1, self.label, self.tau)
+        indices = rank_rows(line, self.tau)
+        self.t_i -= int(np.count_nonzero(self.counts[indices] == 1))
+        self.counts[indices] -= 1
+
+    def retire(self, i):
+        """
+        stop counting the uncovered combinations that can only be covered by rows containing label i
+        """
+        table = comb_table(self.label, self.tau)
+        index = np.arange(len(self.counts), dtype=np.int64)
+        values = (index[:, None] >> np.arange(self.tau - 1, -1, -1)) & 1
+        hit = (self.constraints.implied_by(i)[table[index >> self.tau]] & (values == 1)).any(axis=1)
+        self.valid &= ~(hit & (self.counts == 0))
+        self.size = int(np.count_nonzero(self.valid))
+
+    def sample_uncovered(self, rng: np.random.Generator, size):
+        """
+        draw uncovered combinations at random
+
+        :return: int8 array with shape (size, n), 1/0 for the labels (and values) of the combination, -1 otherwise
+        """
+        forced = np.full((size, self.label), -1, dtype=np.int8)
+        uncovered = np.flatnonzero((self.counts == 0) & self.valid)
+        if len(uncovered) == 0:
+            return forced
+        seeds = uncovered[rng.integers(0, len(uncovered), size)]
+        forced[np.arange(size)[:, None], comb_table(self.label, self.tau)[seeds >> self.tau]] = \
+            (seeds[:, None] >> np.arange(self.tau - 1, -1, -1)) & 1
+        return forced
+
+
+def _mask(labels):
+    mask = 0
+    for i in labels:
+        mask |= 1 << int(i)
+    return mask
+
+
+def _bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def count_hitting_sets(residuals, universe, m):
+    """
+    number of m-subsets of the universe that intersect every residual, all sets are int bitmasks, the search
+    branches on the elements of the smallest residual, so it visits at most max(|residual|)^m nodes
+
+    :param residuals: iterable of sets
+    :param universe: set of allowed elements
+    :param m: size of the subsets
+    :return: number of subsets
+    """
+    res = []
+    packing = 0
+    packed = 0
+    for r in residuals:
+        r &= universe
+        if r == 0:
+            return 0
+        if not r & packing:
+            # more than m pairwise disjoint residuals can never be hit by m elements
+            packing |= r
+            packed += 1
+            if packed > m:
+                return 0
+        res.append(r)
+    if not res:
+        return math.comb(bin(universe).count("1"), m)
+    r = min(res, key=lambda x: bin(x).count("1"))
+    total = 0
+    for e in _bits(r):
+        bit = 1 << e
+        universe &= ~bit
+        total += count_hitting_sets([x for x in res if not x & bit], universe, m - 1)
+    return total
+
+
+def find_hitting_set(residuals, universe, m, rng: np.random.Generator):
+    """
+    a random m-subset of the universe that intersects every residual, see count_hitting_sets
+
+    :return: the subset as int bitmask, None if there is no such subset
+    """
+    res = [r & universe for r in residuals]
+    if any(r == 0 for r in res):
+        return None
+    if not res:
+        elements = list(_bits(universe))
+        if len(elements) < m:
+            return None
+        return _mask(rng.choice(elements, m, replace=False)) if m else 0
+    if m == 0:
+        return None
+    r = min(res, key=lambda x: bin(x).count("1"))
+    for e in rng.permutation(list(_bits(r))):
+        bit = 1 << int(e)
+        found = find_hitting_set([x for x in res if not x & bit], universe & ~bit, m - 1, rng)
+        if found is not None:
+            return found | bit
+    return None
+
+
+class SparseCoverage:
+    """
+    multiset of the covered tau-way combinations for higher strengths (tau >= 3), with the same interface as
+    CoverageCounter
+
+    a combination is split into A, the labels with value 1, and B, the labels with value 0, a row with label set S
+    covers it iff A is a subset of S and B is disjoint from S. so only the subsets A of S (at most 2^k of them,
+    under the counting constraint) are enumerated, and for every A the rows containing it are kept as residuals
+    S - A. the uncovered B of A are the (tau - |A|)-subsets outside A that intersect every residual, they are
+    counted by count_hitting_sets instead of being enumerated, which includes the all-zero combinations (A empty)
+    """
+
+    def __init__(self, label, tau, rows=None, constraints: Constraints = None):
+        self.label = label
+        self.tau = tau
+        self.constraints = constraints or Constraints(label)
+        self.universe = (1 << label) - 1
+        self.families = {}  # A -> {residual: number of rows}
+        self.uncovered = {}  # A -> number of uncovered B, only for A in families
+        self.incomplete = set()  # A with uncovered B
+        # by |A| and colex rank of A: whether A is valid, number of labels outside its closure, whether A is in families
+        self.valid, self.free = zip(*[self.constraints.sets(j) for j in range(tau + 1)])
+        self.seen = [np.zeros(len(valid), dtype=bool) for valid in self.valid]
+        binom = binom_table(label, tau)
+        for j, (valid, free) in enumerate(zip(self.valid, self.free)):
+            valid &= binom[free, tau - j] > 0
+        self.size = int(sum(binom[free[valid], tau - j].sum() for j, (valid, free) in enumerate(zip(self.valid, self.free))))
+        self.t_i = 0
+        if rows is not None:
+            self.add(rows)
+
+    def __len__(self):
+        return self.t_i
+
+    def _subsets(self, line):
+        labels = np.flatnonzero(line).tolist()
+        for j in range(min(len(labels), self.tau) + 1):
+            for a in combinations(labels, j):
+                yield a, _mask(a)
+
+    def add(self, rows):
+        """
+        :param rows: 0/1 row with shape (n,) or rows with shape (m, n)
+        """
+        rows = np.asarray(rows, dtype=np.uint8).reshape(-1, self.label)
+        count_merges("merged", len(rows), self.label, self.tau)
+        for line in rows:
+            s = _mask(np.flatnonzero(line))
+            outside = self.universe & ~s
+            for a, mask in self._subsets(line):
+                m = self.tau - len(a)
+                family = self.families.get(mask)
+                if family is None:
+                    family = self.families[mask] = {}
+                    rank = comb_rank(a)
+                    self.seen[len(a)][rank] = True
+                    self.uncovered[mask] = math.comb(int(self.free[len(a)][rank]), m)
+                    self.incomplete.add(mask)
+                if self.uncovered[mask]:
+                    new = count_hitting_sets(family, outside, m)
+                    self.uncovered[mask] -= new
+                    self.t_i += new
+                    if not self.uncovered[mask]:
+                        self.incomplete.discard(mask)
+                family[s & ~mask] = family.get(s & ~mask, 0) + 1
+
+    def gain(self, lines):
+        """
+        :param lines: candidate rows with shape (m, n)
+        :return: number of uncovered combinations each candidate row would cover
+        """
+        count_merges("scored", len(lines), self.label, self.tau)
+        gains = np.zeros(len(lines), dtype=np.int64)
+        for i, line in enumerate(lines):
+            outside = self.universe & ~_mask(np.flatnonzero(line))
+            for a, mask in self._subsets(line):
+                if mask not in self.families:
+                    gains[i] += math.comb(bin(outside).count("1"), self.tau - len(a))
+                elif self.uncovered[mask]:
+                    gains[i] += count_hitting_sets(self.families[mask], outside, self.tau - len(a))
+        return gains
+
+    def _lost(self, line):
+        s = _mask(np.flatnonzero(line))
+        outside = self.universe & ~s
+        for a, mask in self._subsets(line):
+            family = self.families[mask]
+            residual = s & ~mask
+            if family[residual] > 1:
+                yield a, mask, residual, 0
+            else:
+                others = (r for r in family if r != residual)
+                yield a, mask, residual, count_hitting_sets(others, outside, self.tau - len(a))
+
+    def lost(self, line):
+        """
+        :param line: a row in the array
+        :return: number of combinations that would be no longer covered if the row was removed
+        """
+        return sum(lost for _, _, _, lost in self._lost(line))
+
+    def remove(self, line):
+        """
+        remove a row in the array from the multiset
+        """
+        count_merges("removed from coverage", 1, self.label, self.tau)
+        for a, mask, residual, lost in list(self._lost(line)):
+            self.t_i -= lost
+            family = self.families[mask]
+            family[residual] -= 1
+            if family[residual] == 0:
+                del family[residual]
+            if not family:
+                del self.families[mask], self.uncovered[mask]
+                self.incomplete.discard(mask)
+                self.seen[len(a)][comb_rank(a)] = False
+            elif lost:
+                self.uncovered[mask] += lost
+                self.incomplete.add(mask)
+
+    def retire(self, i):
+        """
+        stop counting the uncovered combinations that can only be covered by rows containing label i
+        """
+        implied_by = self.constraints.implied_by(i)
+        binom = binom_table(self.label, self.tau)
+        for j in range(1, self.tau + 1):
+            hit = implied_by[comb_table(self.label, j)].any(axis=1) & self.valid[j]
+            unseen = hit & ~self.seen[j]
+            self.size -= int(binom[self.free[j][unseen], self.tau - j].sum())
+            self.valid[j][hit] = False
+        mask = _mask(np.flatnonzero(implied_by))
+        for a in [a for a in self.incomplete if a & mask]:
+            self.size -= self.uncovered[a]
+            self.uncovered[a] = 0
+            self.incomplete.discard(a)
+
+    def sample_uncovered(self, rng: np.random.Generator, size):
+        """
+        draw uncovered combinations at random, the label sets A that are in no row so far come first, larger first
+
+        :return: int8 array with shape (size, n), 1/0 for the labels (and values) of the combination, -1 otherwise
+        """
+        forced = np.full((size, self.label), -1, dtype=np.int8)
+        for j in range(self.tau, 0, -1):
+            unseen = np.flatnonzero(self.valid[j] & ~self.seen[j])
+            if len(unseen):
+                forced[np.arange(size)[:, None], comb_table(self.label, j)[rng.choice(unseen, size)]] = 1
+                return forced
+        incomplete = sorted(self.incomplete)
+        for i in range(size if incomplete else 0):
+            mask = incomplete[rng.integers(0, len(incomplete))]
+            line = np.zeros((1, self.label), dtype=np.uint8)
+            line[0, list(_bits(mask))] = 1
+            closure = _mask(np.flatnonzero(self.constraints.close(line)[0]))
+            b = find_hitting_set(
+                self.families[mask], self.universe & ~closure, self.tau - bin(mask).count("1"), rng
+            )
+            forced[i, list(_bits(mask))] = 1
+            forced[i, list(_bits(b))] = 0
+        return forced
+
+
+class CoveringArray:
+    """
+    covering array under construction, the rows are kept in a growable uint8 matrix together with the
+    running number of rows that contain each label and the multiset of the covered tau-way combinations,
+    SparseCoverage is used from strength SPARSE_TAU on and CoverageCounter below it
+    """
+
+    def __init__(self, label, tau, capacity=64, constraints: Constraints = None):
+        self.label = label
+        self.tau = tau
+        self.constraints = constraints or Constraints(label)
+        self.size = 0
+        self.rows = np.zeros((capacity, label), dtype=np.uint8)
+        self.label_count = np.zeros(label, dtype=np.int64)
+        self.covered = self.new_coverage()
+
+    def __len__(self):
+        return self.size
+
+    def new_coverage(self, rows=None):
+        if self.tau >= SPARSE_TAU:
+            covered = SparseCoverage(self.label, self.tau, rows, self.constraints)
+        else:
+            covered = CoverageCounter(self.label, self.tau, rows, self.constraints)
+        self.retired = np.zeros(self.label, dtype=bool)
+        self._retire(covered)
+        return covered
+
+    def _retire(self, covered):
+        for i in np.flatnonzero(self.constraints.exhausted(self.label_count) & ~self.retired):
+            covered.retire(i)
+            self.retired[i] = True
+
+    def _reserve(self, size):
+        if size <= len(self.rows):
+            return
+        capacity = max(size, 2 * len(self.rows))
+        self.rows = np.concatenate([self.rows, np.zeros((capacity - len(self.rows), self.label), np.uint8)])
+
+    def append(self, line):
+        """
+        append a row to the array
+        """
+        self.extend(np.asarray(line, dtype=np.uint8).reshape(1, -1))
+
+    def extend(self, lines):
+        """
+        append several rows to the array
+        """
+        lines = np.asarray(lines, dtype=np.uint8)
+        self._reserve(self.size + len(lines))
+        self.rows[self.size:self.size + len(lines)] = lines
+        with profiler.timer("coverage update"):
+            self.covered.add(lines)
+        profiler.count("rows added", len(lines))
+        self.label_count += lines.sum(axis=0, dtype=np.int64)
+        self.size += len(lines)
+        self._retire(self.covered)
+
+    def select(self, index, covered=None):
+        """
+        keep (and reorder) the rows given by an integer or boolean index
+
+        :param index: integer or boolean index of the rows to keep
+        :param covered: multiset of the combinations covered by the kept rows if already known
+        """
+        rows = self.rows[:self.size][index]
+        self.size = len(rows)
+        self.rows = np.concatenate([rows, np.zeros((max(self.size, 1), self.label), np.uint8)])
+        self.label_count = rows.sum(axis=0, dtype=np.int64)
+        if covered is None:
+            profiler.count("coverage recomputation")
+            with profiler.timer("coverage recomputation"):
+                covered = self.new_coverage(rows)
+        self.covered = covered
+
+    def coverage(self):
+        """
+        :return: coverage, number of tau-way combinations already covered, number of tau-way combinations
+        """
+        t_i = len(self.covered)
+        sut_i = self.covered.size
+        return t_i / sut_i if sut_i else 1, t_i, sut_i
+
+    def sort(self, start=0):
+        """
+        sort rows by the number of labels ascending, then by the label values descending
+
+        :param start: only the rows from this index on are sorted
+        """
+        rows = self.rows[start:self.size].astype(np.int64)
+        order = np.lexsort(np.vstack([-rows[:, ::-1].T, rows.sum(axis=1)]))
+        self.select(np.concatenate([np.arange(start), start + order]), self.covered)
+
+    def to_dataframe(self):
+        array = DataFrame(self.rows[:self.size].astype(int), columns=list(range(self.label)))
+        array["c"] = array.sum(axis=1)
+        return array
+
+
+def add_lines_baseline(array: CoveringArray, rng: np.random.Generator = None):
     """
     the Baseline method to generate covering array, C(n, tau)
     require label >= 2 * tau, otherwise invalid
+    under constraints, every row is closed under the implications and invalid rows are dropped, the valid
+    combinations still uncovered are then covered by add_lines_closure
 
     :param array: current covering array
-    :param label: number of labels
-    :param tau: covering strength
-    :return: updated covering array, coverage
+    :param rng: random generator for add_lines_closure
+    :return: coverage
     """
+    label, tau = array.label, array.tau
     if label < 2 * tau:
         raise Exception(f"bad parameter, excepted label >= 2 * tau, get label: {label}, tau: {tau}")
-    for combination in combinations(list(range(label)), tau):
-        line = np.zeros(label, int)
-        for index in combination:
-            line[index] = 1
-        array.loc[len(array.index), list(range(label))] = line
-    print(f"\rsize: {len(array)}, coverage: 1", end="")
-    return array, 1
+    combs = np.array(list(combinations(range(label), tau)), dtype=np.int64)
+    lines = np.zeros((len(combs), label), dtype=np.uint8)
+    lines[np.arange(len(combs))[:, None], combs] = 1
+    lines = array.constraints.close(lines)
+    lines = lines[array.constraints.valid(lines)]
+    if len(array):
+        # extending an existing array, only the rows with uncovered combinations are added
+        lines = lines[array.covered.gain(lines) > 0]
+    if array.constraints.implies:
+        lines = np.unique(lines, axis=0)
+    if (array.constraints.max_freq < len(lines)).any():
+        # keep the rows in order while every label stays within its maximum frequency
+        keep = np.zeros(len(lines), dtype=bool)
+        label_count = array.label_count.copy()
+        for i, line in enumerate(lines):
+            keep[i] = array.constraints.allowed(line[None], label_count)[0]
+            label_count += line * keep[i]
+        lines = lines[keep]
+    array.extend(lines)
+    coverage, _, _ = array.coverage()
+    while coverage < 1:
+        coverage = add_lines_closure(array, rng or np.random.default_rng(0))
+    print(f"\rsize: {len(array)}, coverage: {coverage}", end="")
+    return coverage
+
+
+def add_lines_closure(array: CoveringArray, rng: np.random.Generator):
+    """
+    cover a random uncovered combination by the smallest row that contains it, i.e. the closure of its 1 values,
+    which is always allowed since uncovered combinations that need an exhausted label are no longer counted
+
+    :param array: current covering array
+    :param rng: random generator
+    :return: coverage
+    """
+    forced = array.covered.sample_uncovered(rng, 1)
+    profiler.count("closure rows")
+    array.append(array.constraints.close(forced == 1)[0])
+    coverage, _, _ = array.coverage()
+    return coverage
 
 
-def add_lines_adaptive_random(array: DataFrame, label, k, tau, current_combinations):
+def add_lines_adaptive_random(array: CoveringArray, k, rng: np.random.Generator):
     """
     the adaptive random method in LV-CIT to generate covering array
 
     :param array: current covering array
-    :param label: number of labels
     :param k: the counting constraint variable
-    :param tau: covering strength
-    :param current_combinations: the combinations that have been covered
-    :return: updated covering array, coverage, and updated current_combinations
+    :param rng: random generator
+    :return: coverage
     """
     try:
-        tmp = add_lines_adaptive_random.old_cov
         tmp = add_lines_adaptive_random.count
     except Exception:
-        add_lines_adaptive_random.old_cov = 0
         add_lines_adaptive_random.count = 0
+    label = array.label
 
     # generate a line adaptive randomly
-    def gen_lines(array):
-        c = math.ceil(np.random.random(1) * k)
-        label_count = array[list(range(label))].sum(axis=0)
-        line = np.zeros(label, int)
-        label_nsmaillest = [
-            idx for idx, val in sorted(
-                [(i, x) for i, x in enumerate(label_count)], key=lambda x: x[1]
-            )[:int(np.random.random(1) * label * 0.5)]
-        ]
+    def gen_lines():
+        c = math.ceil(rng.random() * k)
+        line = np.zeros(label, np.uint8)
+        label_nsmaillest = np.argsort(array.label_count, kind="stable")[:int(rng.random() * label * 0.5)].tolist()
         if add_lines_adaptive_random.count > 1000:
             label_nsmaillest = []
         others = list(set(range(label)).difference(set(label_nsmaillest)))
@@ -180,111 +937,424 @@ def add_lines_adaptive_random(array: DataFrame, label, k, tau, current_combinati
         else:
             c1 = math.ceil(c/2)
             c2 = c - c1
-        index_line = random.sample(label_nsmaillest, c1) + random.sample(others, c2)
+        index_line = rng.choice(label_nsmaillest, c1, replace=False).tolist() + rng.choice(others, c2, replace=False).tolist()
         line[index_line] = 1
         return line
 
-    # check if the new line contains uncovered combinations, if so, add it to the array
-    tmp = pd.DataFrame(columns=array.columns)
-    line = gen_lines(array)
-    tmp.loc[len(tmp.index), list(range(label))] = line
-    coverage0 = add_lines_adaptive_random.old_cov
-    coverage1, t_i, sut_i, current_combinations_new = calculate_coverage(tmp, label, tau, current_combinations)
-    if coverage0 < coverage1:
-        array = pd.concat([array, tmp]).reset_index(drop=True)
-        add_lines_adaptive_random.old_cov = coverage1
+    # check if the new line is allowed and contains uncovered combinations, if so, add it to the array
+    with profiler.timer("candidate generation"):
+        line = array.constraints.close(gen_lines()[None])
+    with profiler.timer("candidate scoring"):
+        accepted = array.constraints.allowed(line, array.label_count)[0] and array.covered.gain(line)[0] > 0
+    if accepted:
+        profiler.count("accepted")
+        array.append(line[0])
+        coverage, t_i, sut_i = array.coverage()
         print(
-            f"\rsize: {len(array)}, coverage: {coverage1}, {t_i}/{sut_i}, count: {add_lines_adaptive_random.count}",
+            f"\rsize: {len(array)}, coverage: {coverage}, {t_i}/{sut_i}, count: {add_lines_adaptive_random.count}",
             end=""
         )
         add_lines_adaptive_random.count = 0
-        return array, coverage1, current_combinations_new
     else:
+        profiler.count("rejected")
         add_lines_adaptive_random.count += 1
-        return array, coverage0, current_combinations
+        coverage, _, _ = array.coverage()
+    return coverage
 
 
-def del_lines(array: DataFrame, label, tau, thr):
+def add_lines_greedy(array: CoveringArray, k, rng: np.random.Generator, batch_size=64):
+    """
+    the greedy method (AETG/IPOG-style) to generate covering array: draw a batch of candidate rows, each one
+    built around a randomly chosen uncovered combination, and accept the one that covers the most uncovered
+    combinations
+
+    :param array: current covering array
+    :param k: the counting constraint variable
+    :param rng: random generator
+    :param batch_size: number of candidate rows scored at once
+    :return: coverage
+    """
+    label = array.label
+    coverage, _, _ = array.coverage()
+    if coverage == 1:
+        return 1
+
+    with profiler.timer("candidate generation"):
+        # seed combinations, their 1 values are forced into the row and their 0 values are kept out of it
+        forced = array.covered.sample_uncovered(rng, batch_size)
+        ones = (forced == 1).sum(axis=1)
+        c = np.maximum(ones, rng.integers(np.maximum(ones, 1), max(k, 1) + 1))
+
+        # weighted sampling without replacement by exponential keys, under-used labels are preferred
+        weights = 1 / (1 + array.label_count)
+        keys = -np.log(1 - rng.random((batch_size, label))) / weights
+        keys[:, array.constraints.exhausted(array.label_count)] = np.inf
+        keys[forced == 1] = -np.inf
+        keys[forced == 0] = np.inf
+        order = np.argsort(keys, axis=1)
+        lines = np.zeros((batch_size, label), dtype=np.uint8)
+        lines[np.arange(batch_size)[:, None], order] = np.arange(label) < c[:, None]
+        lines = array.constraints.close(lines)
+
+    # score all candidates in one pass and accept the best allowed one
+    with profiler.timer("candidate scoring"):
+        scores = np.where(array.constraints.allowed(lines, array.label_count), array.covered.gain(lines), 0)
+    best = int(np.argmax(scores))
+    if scores[best] > 0:
+        profiler.count("accepted")
+        profiler.count("rejected", batch_size - 1)
+        array.append(lines[best])
+        coverage, t_i, sut_i = array.coverage()
+    else:
+        profiler.count("rejected", batch_size)
+        coverage = add_lines_closure(array, rng)
+        _, t_i, sut_i = array.coverage()
+    print(f"\rsize: {len(array)}, coverage: {coverage}, {t_i}/{sut_i}, new: {scores[best]}", end="")
+    return coverage
+
+
+def add_lines_frequency(array: CoveringArray):
+    """
+    add the smallest rows containing the labels under their minimum frequencies
+
+    :param array: current covering array
+    :return: coverage
+    """
+    constraints = array.constraints
+    for i in np.flatnonzero(array.label_count < constraints.min_freq):
+        line = np.zeros((1, array.label), dtype=np.uint8)
+        line[0, i] = 1
+        line = constraints.close(line)
+        if not constraints.allowed(line, array.label_count)[0]:
+            raise Exception(f"unsatisfiable constraints, label {i} can not appear {constraints.min_freq[i]} times")
+        array.extend(np.repeat(line, constraints.min_freq[i] - array.label_count[i], axis=0))
+    coverage, _, _ = array.coverage()
+    return coverage
+
+
+def del_lines(array: CoveringArray, thr, start=0):
     """
     delete rows from the covering array, if the coverage is still greater than the threshold after deletion
+    and the minimum frequencies of the labels are kept
 
     :param array: covering array
-    :param label: number of labels
-    :param tau: covering strength
     :param thr: threshold
+    :param start: only the rows from this index on can be deleted
     :return: updated covering array
     """
-    current_combinations = {}
-    batch_size = int(math.sqrt(len(array)))
-    for j in range(0, len(array), batch_size):
-        array.loc[j: j + batch_size - 1, "combinations"].apply(
-            lambda x: current_combinations[(j, j+batch_size)].update(x)
-            if (j, j+batch_size) in current_combinations.keys() else current_combinations.update({(j, j+batch_size): x.copy()})
-        )
+    covered = array.covered
+    label_count = array.label_count.copy()
+    keep = np.ones(len(array), dtype=bool)
     i = len(array) - 1
-    while i >= 0:
-        cov, _, _, current_combinations_tmp = calculate_coverage(
-            array.drop(index=[i]), label, tau, current_combinations, True, i
-        )
-        if cov >= thr:
-            array.drop(index=[i], inplace=True)
-            current_combinations = current_combinations_tmp
-            print(f"\rreduced size: {len(array)}", end="")
+    while i >= start:
+        line = array.rows[i]
+        profiler.count("lost checks")
+        if (len(covered) - covered.lost(line)) / covered.size >= thr and array.constraints.removable(line, label_count):
+            profiler.count("removed")
+            covered.remove(line)
+            label_count -= line
+            keep[i] = False
+            print(f"\rreduced size: {keep.sum()}", end="")
         i -= 1
+    array.select(keep, covered)
     return array
 
 
-def get_covering_array(method, label, k, tau, thr: float = 1.0):
+def generate(array: CoveringArray, method, k, thr, rng: np.random.Generator, batch_size=64, timings=None):
+    """
+    add rows to the covering array by the specified method until the coverage reaches the threshold, then sort
+    and reduce the added rows, the rows already in the array are kept as they are
+
+    :param timings: dict to store the wall time of the generation and reduction phases in, if given
+    :return: covering array, coverage
+    """
+    start = len(array)
+    phase_start = time.perf_counter()
+    coverage, _, _ = array.coverage()
+    add_lines_adaptive_random.count = 0
+    with profiler.timer("generation"):
+        while coverage < thr:
+            if method == "baseline":
+                coverage = add_lines_baseline(array, rng)
+            elif method == "adaptive random":
+                coverage = add_lines_adaptive_random(array, k, rng)
+            elif method == "greedy":
+                coverage = add_lines_greedy(array, k, rng, batch_size)
+            else:
+                raise Exception(f"unknown method: {method}")
+        coverage = add_lines_frequency(array)
+    print("")
+    generation_end = time.perf_counter()
+    with profiler.timer("sort"):
+        array.sort(start)
+    if method != "baseline":
+        with profiler.timer("reduction"):
+            array = del_lines(array, thr, start)
+        print("")
+    if timings is not None:
+        timings["generation"] = generation_end - phase_start
+        timings["reduction"] = time.perf_counter() - generation_end
+    return array.to_dataframe(), coverage
+
+
+def get_covering_array(
+        method, label, k, tau, thr: float = 1.0, batch_size=64, seed=None, constraints=None, timings=None
+):
     """
     Get the covering array by the specified method
 
-    :param method: the method to generate covering array, baseline or adaptive random
+    :param method: the method to generate covering array, baseline, adaptive random or greedy
     :param label: number of labels
     :param k: the maximum number of labels in a combination
     :param tau: the counting constraint variable
     :param thr: the threshold of coverage, default 100%
+    :param batch_size: number of candidate rows scored at once by the greedy method
+    :param seed: seed of the random generator, the same seed gives the same covering array
+    :param constraints: Constraints on the rows, default only the counting constraint k
+    :param timings: dict to store the wall time of the generation and reduction phases in, if given
     :return: covering array, coverage
     """
-    array = DataFrame(columns=list(range(label)) + ["combinations"])
-    coverage = 0
-    current_combinations = BitSet(
-        int(comb(label, tau) * pow(2, tau)),
-        tau,
-        {cb: idx for idx, cb in enumerate(combinations(range(label), tau))}
-    )
-    add_lines_adaptive_random.old_cov = 0
-    add_lines_adaptive_random.count = 0
-    while coverage < thr:
-        if method == "baseline":
-            array, coverage = add_lines_baseline(array, label, tau)
-        elif method == "adaptive random":
-            array, coverage, current_combinations = add_lines_adaptive_random(array, label, k, tau, current_combinations)
-    print("")
-    array["c"] = array[list(range(label))].apply(lambda x: x.sum(), axis=True)
-    array.sort_values(by=["c"] + list(range(label)), inplace=True, ascending=[True] + [False] * label)
-    array.reset_index(drop=True, inplace=True)
-    if method != "baseline":
-        array = del_lines(array, label, tau, thr)
-        print("")
-    array = array[list(range(label)) + ["c"]]
-    return array, coverage
+    rng = np.random.default_rng(seed)
+    array = CoveringArray(label, tau, constraints=constraints or Constraints(label, k))
+    return generate(array, method, k, thr, rng, batch_size, timings)
+
+
+def extend_covering_array(
+        base: DataFrame, method, label, k, tau, thr: float = 1.0, batch_size=64, seed=None, constraints=None,
+        timings=None
+):
+    """
+    Extend an existing covering array to the threshold of coverage, possibly with more labels (the new labels
+    take the last columns and are 0 in the existing rows) or a higher strength, the existing rows come first in
+    the result and are never changed or deleted
+
+    :param base: existing covering array, columns are 0, ..., n'-1 (and c), see CoveringArrayStore.read
+    :return: covering array, coverage
+    """
+    rows = base[[c for c in base.columns if c != "c"]].values.astype(np.uint8)
+    if rows.shape[1] > label:
+        raise Exception(f"bad parameter, excepted label >= {rows.shape[1]} of the existing array, get label: {label}")
+    rows = np.pad(rows, ((0, 0), (0, label - rows.shape[1])))
+    constraints = constraints or Constraints(label, k)
+    invalid = np.flatnonzero(~constraints.valid(rows))
+    if len(invalid):
+        raise Exception(f"rows {invalid.tolist()} of the existing covering array violate the constraints")
+    rng = np.random.default_rng(seed)
+    array = CoveringArray(label, tau, len(rows), constraints)
+    array.extend(rows)
+    return generate(array, method, k, thr, rng, batch_size, timings)
+
+
+def task_seed(seed, label, k, tau, method, i):
+    """
+    explicit seed of the i-th covering array of a configuration, derived from the base seed of a sweep
+    """
+    key = [seed, label, k, tau, zlib.crc32(method.encode()), i]
+    return int(np.random.SeedSequence(key).generate_state(1, np.uint64)[0] >> np.uint64(1))
+
+
+class CoveringArrayStore:
+    """
+    covering arrays keyed by (method, n, k, tau, thr, seed), every array is saved as packed bits in its own .npz
+    file and indexed in manifest.csv under the root directory, arrays imported from the old csv files have
+    negative seeds since the seeds they were generated with are unknown
+    """
+
+    def __init__(self, root=output_dir):
+        self.root = root
+        self.manifest = os.path.join(root, "manifest.csv")
+
+    def file(self, method, label, k, tau, thr=1.0, seed=0):
+        """
+        :return: path of the array relative to the root directory
+        """
+        return os.path.join(method, f"ca_{method}_{label}_{k}_{tau}_{float(thr)}_{seed}.npz")
+
+    def index(self):
+        """
+        :return: the manifest, with the absolute path of every array in the "path" column
+        """
+        if os.path.exists(self.manifest):
+            index = pd.read_csv(self.manifest, dtype={"seed": np.int64})
+        else:
+            index = DataFrame(columns=MANIFEST_COLUMNS)
+        index["path"] = [os.path.join(self.root, file) for file in index["file"]]
+        return index
+
+    def find(self, method=None, label=None, k=None, tau=None, thr=None):
+        """
+        find the arrays that match all the given parameters
+
+        :return: matched rows of the manifest, ordered by seed
+        """
+        index = self.index()
+        for column, value in zip(["method", "n", "k", "tau", "thr"], [method, label, k, tau, thr]):
+            if value is not None:
+                index = index[index[column] == value]
+        return index.sort_values(by="seed", key=lambda s: s.abs()).reset_index(drop=True)
+
+    def contains(self, method, label, k, tau, thr=1.0, seed=0):
+        index = self.find(method, label, k, tau, thr)
+        return bool((index["seed"] == seed).any())
+
+    @staticmethod
+    def read(path):
+        """
+        read a covering array from a .npz file of the store or an old .csv file
+
+        :return: covering array, columns are 0, ..., n-1 and c
+        """
+        if path.endswith(".csv"):
+            array = pd.read_csv(path)
+            array.columns = [int(c) if c.isdigit() else c for c in array.columns]
+            return array
+        with np.load(path) as f:
+            rows = np.unpackbits(f["bits"], axis=1, count=int(f["label"]))
+        array = DataFrame(rows.astype(int), columns=list(range(rows.shape[1])))
+        array["c"] = array.sum(axis=1)
+        return array
+
+    def write(self, array: DataFrame, method, label, k, tau, thr, seed, time_cost, coverage):
+        """
+        save a covering array, the manifest is not touched so that workers can write arrays in parallel
+
+        :return: record of the array to be registered
+        """
+        file = self.file(method, label, k, tau, thr, seed)
+        path = os.path.join(self.root, file)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        np.savez_compressed(
+            path, label=label, bits=np.packbits(array[list(range(label))].values.astype(np.uint8), axis=1)
+        )
+        return dict(zip(MANIFEST_COLUMNS, [method, label, k, tau, float(thr), seed, len(array), time_cost, coverage, file]))
+
+    def register(self, record):
+        """
+        append the record of a saved array to the manifest, the manifest gets the columns of the record that are
+        not in MANIFEST_COLUMNS (e.g. base, see task) when it does not have them yet
+        """
+        new_file = not os.path.exists(self.manifest)
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        fieldnames = MANIFEST_COLUMNS + [column for column in record if column not in MANIFEST_COLUMNS]
+        if not new_file:
+            index = pd.read_csv(self.manifest, dtype={"seed": np.int64})
+            if set(fieldnames) - set(index.columns):
+                index.reindex(columns=list(index.columns) + [c for c in fieldnames if c not in index.columns]) \
+                    .to_csv(self.manifest, index=False)
+            fieldnames = pd.read_csv(self.manifest, nrows=0).columns.tolist()
+        with open(self.manifest, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(record)
+
+    def get(self, method, label, k, tau, thr=1.0, seed=0, batch_size=64, constraints=None):
+        """
+        get the covering array from the store, generate and save it if it does not exist
 
+        :param constraints: path of the constraints json file, arrays under different constraints should be kept
+        in different stores
+        :return: covering array
+        """
+        if not self.contains(method, label, k, tau, thr, seed):
+            self.register(task(label, k, tau, method, thr, batch_size, seed, self.root, constraints))
+        return self.read(os.path.join(self.root, self.file(method, label, k, tau, thr, seed)))
 
-def task(label, k, tau, method="random", thr=1.0):
-    print(label, k, tau, method, thr)
+    def import_csv(self, files):
+        """
+        import covering arrays from the old csv files named ca_{method}_{label}_{k}_{tau}_{size}_{time}.csv,
+        the i-th file (in sorted order) of a configuration gets seed -i
+        """
+        seeds = {}
+        for file in sorted(files):
+            parts = os.path.basename(file)[3:-4].rsplit("_", 5)
+            if len(parts) != 6:
+                continue
+            method, label, k, tau, _, time_cost = parts
+            label, k, tau = int(label), int(k), int(tau)
+            seed = seeds[(method, label, k, tau)] = seeds.get((method, label, k, tau), 0) - 1
+            if self.contains(method, label, k, tau, 1.0, seed):
+                continue
+            array = self.read(file)
+            covering_array = CoveringArray(label, tau, len(array))
+            covering_array.extend(array[list(range(label))].values)
+            self.register(self.write(
+                array, method, label, k, tau, 1.0, seed, float(time_cost), covering_array.coverage()[0]
+            ))
+
+
+def array_digest(array: DataFrame):
+    """
+    :return: short hash of the rows of a covering array, the same whatever file format it was read from
+    """
+    labels = [column for column in array.columns if column != "c"]
+    bits = np.packbits(array[labels].values.astype(np.uint8), axis=1)
+    return hashlib.sha1(np.int64(len(labels)).tobytes() + bits.tobytes()).hexdigest()[:12]
+
+
+def task(
+        label, k, tau, method="random", thr=1.0, batch_size=64, seed=None, root=output_dir, constraints=None,
+        extend=None, profile=False
+):
+    """
+    generate a covering array and save it in the store under root
+
+    :param constraints: path of the constraints json file
+    :param extend: path of an existing covering array to extend instead of starting from an empty one, the
+    arrays extended from different bases should be kept in different stores
+    :param profile: save the timers and counters of the run in a .profile.json file next to the array
+    :return: record of the array to be registered, with the path of the extended array in a base column if any
+    """
+    print(label, k, tau, method, thr, seed)
+    profiler.reset(enabled=profile)
     start = time.process_time()
-    array, coverage = get_covering_array(method, label, k, tau, thr)
+    rules = Constraints.load(constraints, label, k) if constraints else None
+    if extend:
+        base = CoveringArrayStore.read(extend)
+        array, coverage = extend_covering_array(base, method, label, k, tau, thr, batch_size, seed, rules)
+    else:
+        array, coverage = get_covering_array(method, label, k, tau, thr, batch_size, seed, rules)
     end = time.process_time()
     # print(array)
     print(f"final size: {len(array)}, coverage: {coverage}, time: {end - start}")
-    res_path = os.path.join(
-        output_dir,
-        method,
-        f"ca_{method}_{label}_{k}_{tau}_{len(array)}_{end - start}.csv"
-    )
-    if not os.path.exists(os.path.dirname(res_path)):
-        os.makedirs(os.path.dirname(res_path))
-    array.to_csv(res_path, index=False)
+    store = CoveringArrayStore(root)
+    record = store.write(array, method, label, k, tau, thr, seed, end - start, coverage)
+    if extend:
+        record["base"] = extend
+    if profile:
+        profiler.save(
+            os.path.join(root, os.path.splitext(record["file"])[0] + ".profile.json"),
+            **record, batch_size=batch_size, constraints=constraints, extend=extend
+        )
+        profiler.reset(enabled=False)
+    return record
+
+
+def sweep(tasks, workers=None, store=None, **kwargs):
+    """
+    generate covering arrays in a process pool, tasks already in the store are skipped so that an interrupted
+    sweep resumes where it stopped
+
+    :param tasks: list of (label, k, tau, method, seed)
+    :param workers: number of worker processes, default os.cpu_count()
+    :param store: CoveringArrayStore, every completed task is registered in its manifest
+    :param kwargs: other arguments of task, e.g. thr, batch_size
+    :return: manifest
+    """
+    store = store or CoveringArrayStore()
+    thr = kwargs.get("thr", 1.0)
+    todo = [t for t in tasks if not store.contains(t[3], t[0], t[1], t[2], thr, t[4])]
+    print(f"{len(tasks) - len(todo)}/{len(tasks)} tasks already done")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(task, label, k, tau, method, seed=seed, root=store.root, **kwargs)
+            for label, k, tau, method, seed in todo
+        ]
+        for future in as_completed(futures):
+            store.register(future.result())
+    return store.index()
 
 
 if __name__ == '__main__':
@@ -296,25 +1366,64 @@ if __name__ == '__main__':
     parser.add_argument(
         "--method", "-m",
         type=str, default="adaptive random",
-        help="method to generate covering array, baseline or adaptive random"
+        help="method to generate covering array, baseline, adaptive random or greedy"
     )
     parser.add_argument("--all", "-a", type=str2bool, default=True, help="generate covering arrays for all")
     parser.add_argument("-n", type=int, default=20, help="number of labels (size of label space)")
     parser.add_argument("-k", type=int, default=4, help="the counting constraint value, default 4")
     parser.add_argument("-t", type=int, default=2, help="covering strength, default 2")
     parser.add_argument("--number", type=int, default=1, help="how many covering arrays to generate")
+    parser.add_argument(
+        "--batch", "-b", type=int, default=64, help="number of candidate rows scored at once by greedy, default 64"
+    )
+    parser.add_argument("--seed", "-s", type=int, default=0, help="base seed, every task derives its own seed from it")
+    parser.add_argument("--workers", "-w", type=int, default=None, help="number of worker processes for --all")
+    parser.add_argument(
+        "--import_dir", type=str, default=None, help="import the old csv covering arrays under this directory"
+    )
+    parser.add_argument(
+        "--constraints", "-c", type=str, default=None,
+        help="json file of the constraints (forbidden, implies, min_freq, max_freq), "
+             "the arrays are saved in a subdirectory named after the file and a hash of the constraints"
+    )
+    parser.add_argument(
+        "--profile", "-p", type=str2bool, default=False,
+        help="save the timers and counters of every run in a .profile.json file next to the covering array"
+    )
+    parser.add_argument(
+        "--extend", "-e", type=str, default=None,
+        help="extend this covering array (.npz or .csv) to -n labels and strength -t instead of "
+             "generating a new one, needs --all=False, "
+             "the arrays are saved in the subdirectory extended/<name of the array>_<hash of its rows>"
+    )
     args = parser.parse_args()
-    if args.all:
-        for n in [20, 80]:
-            for k in range(2, 7):
-                for _ in range(5):
-                    tau = 2
-                    task(n, k, tau, "baseline")
-        for n in [20, 80]:
-            for k in range(2, 7):
-                for _ in range(5):
-                    tau = 2
-                    task(n, k, tau, "adaptive random")
+    if args.extend and args.all:
+        parser.error("--extend extends one configuration, use it with --all=False")
+    store = CoveringArrayStore()
+    if args.constraints:
+        store = CoveringArrayStore(os.path.join(output_dir, Constraints.store_name(args.constraints)))
+    if args.extend:
+        # the tasks of different bases have the same keys, so every base gets its own store
+        base_name = os.path.splitext(os.path.basename(args.extend))[0]
+        base_name = f"{base_name}_{array_digest(CoveringArrayStore.read(args.extend))}"
+        store = CoveringArrayStore(os.path.join(store.root, "extended", base_name))
+    if args.import_dir:
+        store.import_csv(
+            glob.glob(os.path.join(args.import_dir, "**", "ca_*.csv"), recursive=True)
+        )
+    elif args.all:
+        tau = 2
+        tasks = [
+            (n, k, tau, method, task_seed(args.seed, n, k, tau, method, i))
+            for method in ["baseline", "adaptive random"] for n in [20, 80] for k in range(2, 7) for i in range(5)
+        ]
+        sweep(tasks, args.workers, store, constraints=args.constraints, profile=args.profile)
     else:
-        for _ in range(args.number):
-            task(args.n, args.k, args.t, args.method)
+        tasks = [
+            (args.n, args.k, args.t, args.method, task_seed(args.seed, args.n, args.k, args.t, args.method, i))
+            for i in range(args.number)
+        ]
+        sweep(
+            tasks, 1, store,
+            batch_size=args.batch, constraints=args.constraints, extend=args.extend, profile=args.profile
+        )
@@ -1,22 +1,26 @@
 import csv
-import random
+import io
+import contextlib
 import time
-import imutils
 import numpy as np
 import pandas as pd
 import cv2
 import math
 import os
 from shapely import affinity, geometry
-import glob
 from itertools import combinations
 from tqdm import tqdm
 import warnings
-from collections import defaultdict
+from collections import OrderedDict, deque
 import threading
+import queue
 import argparse
+import functools
+import operator
 from util import str2bool
-from concurrent.futures import ThreadPoolExecutor
+from ca_generator import CoveringArrayStore, array_digest, task_seed
+from suite import SuiteWriter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 warnings.filterwarnings('ignore')
 
 DATA_DIR = os.path.join("data", "lvcit")
@@ -34,7 +38,9 @@ MODELS = {
     "COCO": ["msrn", "mlgcn", "asl"],
 }
 COVERING_ARRAY_DIR = os.path.join(DATA_DIR, "1covering_array")
+SHARED_DIR = "shared"  # directory of the composite images shared by all the models, see img_composite
 MAX_ANGLE = 10
+PLACEMENT_CELL = 2  # cell size (px) of the occupancy grid of Placement
 DO_COMPONENTS = False
 CA_METHOD = "adaptive random"
 
@@ -43,85 +49,297 @@ DO_SCALE = True
 DO_ANGLE = False
 BACKGROUND_COLOR = (255, 255, 255, 255)
 COMPOSITE_METHOD = "random"
+PASTE_MODE = "bitwise"  # bitwise, mask or alpha, see paste_img
+SAMPLE_DISTANCE = "orb"  # orb, hist or phash, see distance_matrix
+SAMPLE_THREADS = 0  # threads of distance_matrix
+PIPELINE_DEPTH = 2  # rows held between two stages of img_composite, see pipeline
+IMG_FORMAT = "png"  # png, webp, npy (see encode_img) or suite (one packed shard per directory, see suite.py)
+IMG_EXTENSIONS = {"png": ".png", "webp": ".webp", "npy": ".npy", "suite": ""}
+PNG_COMPRESSION = None  # zlib level (0-9) of the png images, None: the default of OpenCV
+ENCODE_WORKERS = 4  # threads encoding the images of a row, 0: the saving thread
 VERSION = f"v6_{COMPOSITE_METHOD}_{'_'.join([str(i) for i in BACKGROUND_COLOR])}_s{1 if DO_SCALE else 0}a{1 if DO_ANGLE else 0}"
 
 
+LIBRARY_MANIFEST = "library_manifest.npz"
+LIBRARY_COLUMNS = ["labelid", "label", "file", "size", "mtime"]
+
+
+def scan_label_dir(label_dir):
+    """
+    list the object images under a label directory
+
+    :return: (files with their size and mtime, mtimes of all directories under the label directory)
+    """
+    files, dirs = [], {}
+    for path, dir_list, file_list in os.walk(label_dir):
+        dir_list.sort()
+        dirs[path] = os.stat(path).st_mtime
+        for file_name in sorted(file_list):
+            file = os.path.join(path, file_name)
+            stat = os.stat(file)
+            files.append((file, stat.st_size, stat.st_mtime))
+    return files, dirs
+
+
+def unchanged(dirs, files):
+    """
+    :param dirs: mtimes of the directories of a label, see scan_label_dir
+    :param files: files of the label with their size and mtime, see scan_label_dir
+    :return: whether no file of the label was added, removed, renamed or overwritten since
+    """
+    try:
+        if any(os.stat(path).st_mtime != mtime for path, mtime in dirs.items()):
+            return False
+        for file, size, mtime in files:
+            # an object overwritten in place does not change the mtime of its directory
+            stat = os.stat(file)
+            if stat.st_size != size or stat.st_mtime != mtime:
+                return False
+        return True
+    except FileNotFoundError:
+        return False
+
+
+_manifest_lock = threading.Lock()
+
+
+def read_library_manifest(path, root):
+    """
+    :param path: LIBRARY_MANIFEST of a library
+    :param root: absolute path of the library
+    :return: ({label: mtimes of its directories}, {label: files with their size and mtime}), empty if the manifest
+             is missing or was written for another directory
+    """
+    if not os.path.exists(path):
+        return {}, {}
+    with np.load(path) as data:
+        if str(data["root"]) != root:
+            # a library copied or moved with its manifest, whose paths are those of the old directory
+            return {}, {}
+        dirs, files = {}, {}
+        for label, dir_path, mtime in zip(data["dir_label"].tolist(), data["dir"].tolist(),
+                                          data["dir_mtime"].tolist()):
+            dirs.setdefault(label, {})[dir_path] = mtime
+        for label, file, size, mtime in zip(data["label"].tolist(), data["path"].tolist(), data["size"].tolist(),
+                                            data["mtime"].tolist()):
+            files.setdefault(label, []).append((file, size, mtime))
+    return dirs, {label: files.get(label, []) for label in dirs}
+
+
+def write_library_manifest(path, root, dirs, files):
+    """
+    write LIBRARY_MANIFEST as one column per field (label, path, size, mtime of the files and dir_label, dir,
+    dir_mtime of the directories of the labels), it is replaced atomically so that threads and processes never read a partial one
+    """
+    file_rows = [(label, ) + file for label in files for file in files[label]]
+    dir_rows = [(label, dir_path, mtime) for label in dirs for dir_path, mtime in dirs[label].items()]
+    label, file, size, mtime = zip(*file_rows) if file_rows else ([], [], [], [])
+    dir_label, dir_path, dir_mtime = zip(*dir_rows) if dir_rows else ([], [], [])
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f, root=np.array(root),
+            label=np.array(label, dtype=str), path=np.array(file, dtype=str),
+            size=np.array(size, dtype=np.int64), mtime=np.array(mtime, dtype=np.float64),
+            dir_label=np.array(dir_label, dtype=str), dir=np.array(dir_path, dtype=str),
+            dir_mtime=np.array(dir_mtime, dtype=np.float64),
+        )
+    os.replace(tmp, path)
+
+
+def load_library_manifest(input_dir):
+    """
+    load the manifest of the object library under input_dir (one directory per label), it is cached in
+    LIBRARY_MANIFEST and only the label directories that changed since (files added, removed or renamed by the
+    mtimes of their directories, files overwritten by their sizes and mtimes) are scanned again
+
+    :param input_dir: directory of object images
+    :return: DataFrame with LIBRARY_COLUMNS, label ids follow the sorted labels, number of labels
+    """
+    path = os.path.join(input_dir, LIBRARY_MANIFEST)
+    with _manifest_lock:
+        root = os.path.abspath(input_dir)
+        cached_dirs, cached_files = read_library_manifest(path, root)
+        labels = sorted(entry.name for entry in os.scandir(input_dir) if entry.is_dir())
+        dirs, files = {}, {}
+        for label in labels:
+            if label in cached_dirs and unchanged(cached_dirs[label], cached_files[label]):
+                dirs[label], files[label] = cached_dirs[label], cached_files[label]
+            else:
+                files[label], dirs[label] = scan_label_dir(os.path.join(input_dir, label))
+        if dirs != cached_dirs or files != cached_files:
+            write_library_manifest(path, root, dirs, files)
+    library = pd.DataFrame(
+        [(labelid, label) + file for labelid, label in enumerate(labels) for file in files[label]],
+        columns=LIBRARY_COLUMNS,
+    )
+    return library, len(labels)
+
+
 def get_matting_img(input_dir, model_name=None):
-    matting_img = pd.DataFrame(columns=["labelid", "label", "file"])
+    """
+    get the object images from the library manifest
+
+    :param input_dir: directory of object images
+    :param model_name: if not None, only the object images that pass the model in object_detect.csv, if a list of
+    models, the object images that pass any of them, with the bitmask of the models they pass (bit i for
+    model_name[i]) in a models column
+    :return: object images (labelid, label, file, size, mtime[, models], count), number of labels
+    """
+    library, count = load_library_manifest(input_dir)
     if model_name:
+        models = [model_name] if isinstance(model_name, str) else list(model_name)
         object_detect_df = pd.read_csv(os.path.join(input_dir, "object_detect.csv"))
-        count = object_detect_df["target"].drop_duplicates().count()
-        cat2id = {cat: id for id, cat in enumerate(sorted(object_detect_df["target"].drop_duplicates()))}
-        matting_img[["labelid", "label", "file"]] = object_detect_df[
-            object_detect_df[model_name] == 1
-        ].apply(
-            lambda x: (cat2id[x["target"]], x["target"], os.path.join(input_dir, x["target"], x["filename"])),
-            axis=1,
-            result_type="expand",
-        )
+        targets = sorted(object_detect_df["target"].drop_duplicates())
+        count = len(targets)
+        cat2id = {cat: id for id, cat in enumerate(targets)}
+        masks = (object_detect_df[models].values == 1) @ (1 << np.arange(len(models)))
+        passed = object_detect_df.loc[masks > 0, ["target", "filename"]]
+        passed = pd.DataFrame({
+            "file": [os.path.join(input_dir, target, filename) for target, filename in passed.values],
+            "models": masks[masks > 0],
+        })
+        matting_img = passed.merge(library.drop(columns="labelid"), on="file")
+        matting_img.insert(0, "labelid", matting_img["label"].map(cat2id))
+        matting_img = matting_img[LIBRARY_COLUMNS + ([] if isinstance(model_name, str) else ["models"])]
     else:
-        fileinfo = os.walk(input_dir)
-        count = 0
-        for label in fileinfo.__next__()[1]:
-            label_dir = os.path.join(input_dir, label)
-            for path, dir_list, file_list in os.walk(label_dir):
-                for file_name in file_list:
-                    file = os.path.join(path, file_name)
-                    line = [count, label, file]
-                    matting_img.loc[len(matting_img.index)] = line
-            count += 1
-    matting_img["count"] = matting_img.apply(lambda x: 0, axis=1)
+        matting_img = library
+    matting_img = matting_img.reset_index(drop=True)
+    matting_img["count"] = 0
     return matting_img, count
 
 
-def select(matting_img: pd.DataFrame, line, num, max_time, method):
+def valid_models(combs, masks, models):
+    """
+    :param combs: combinations of object images, see select
+    :param masks: file -> bitmask of the models the object image passes, see get_matting_img
+    :param models: list of models
+    :return: for every combination, the bitmask of the models all its object images pass
+    """
+    return [
+        functools.reduce(operator.and_, (int(masks[file]) for file, _ in comb), (1 << len(models)) - 1)
+        for comb in combs
+    ]
+
+
+def model_names(mask, models):
+    """
+    :return: "|" joined names of the models in the bitmask
+    """
+    return "|".join(model for i, model in enumerate(models) if mask >> i & 1)
+
+
+class ObjectLibrary:
+    """
+    index of the object images by label id, for every label the file ids are kept ordered by usage count (a
+    bucketed array), so that the objects under a usage cap are a prefix of the array and the number of them is
+    known in O(1), using an object moves it to the end of its bucket by one swap
+
+    :param matting_img: object images, see get_matting_img
+    """
+
+    def __init__(self, matting_img: pd.DataFrame):
+        self.files = matting_img["file"].to_numpy()
+        self.labels = matting_img["label"].to_numpy()
+        self.counts = np.zeros(len(matting_img), dtype=np.int64)
+        self.pos = np.zeros(len(matting_img), dtype=np.int64)  # position of every id in the array of its label
+        self.labelids = labelids = matting_img["labelid"].to_numpy(dtype=np.int64)
+        self.ids = {}  # label id -> file ids in file order
+        self.order = {}  # label id -> file ids ordered by usage count
+        self.under = {}  # label id -> under[c] is the number of file ids used less than c times
+        for labelid in np.unique(labelids):
+            ids = np.flatnonzero(labelids == labelid)
+            self.ids[labelid] = ids
+            self.order[labelid] = ids.copy()
+            self.pos[ids] = np.arange(len(ids))
+            self.under[labelid] = [0, len(ids)]
+
+    def __len__(self):
+        return len(self.files)
+
+    def has(self, label):
+        return label in self.ids
+
+    def available(self, label, max_time):
+        """
+        :return: number of object images of the label selected less than max_time times, all of them if max_time is 0
+        """
+        under = self.under[label]
+        if max_time == 0 or max_time >= len(under):
+            return under[-1]
+        return under[max_time]
+
+    def pick(self, label, index):
+        """
+        :return: file id of the index-th object image of the label in the order of usage count
+        """
+        return int(self.order[label][index])
+
+    def nth(self, label, max_time, index):
+        """
+        :return: file id of the (index mod available)-th object image of the label under the cap, in file order
+        """
+        ids = self.ids[label]
+        if max_time != 0:
+            ids = ids[self.counts[ids] < max_time]
+        return int(ids[index % len(ids)])
+
+    def use(self, file_ids):
+        """
+        increase the usage counts of the object images
+        """
+        for file_id in file_ids:
+            label = self.labelids[file_id]
+            order, under = self.order[label], self.under[label]
+            count = self.counts[file_id]
+            if count + 2 >= len(under):
+                under.append(under[-1])
+            # swap the file id with the last one of its bucket, which then becomes the first of the next bucket
+            last = under[count + 1] - 1
+            other = order[last]
+            order[self.pos[file_id]], order[last] = other, file_id
+            self.pos[other], self.pos[file_id] = self.pos[file_id], last
+            under[count + 1] -= 1
+            self.counts[file_id] += 1
+
+
+def select(library: ObjectLibrary, line, num, max_time, method, rng):
     """
     select object images for test cases randomly
 
-    :param matting_img: object images
+    :param library: index of the object images
     :param line: a line in the covering array
     :param num: number of test images for each test case
     :param max_time: maximum number of times an object image can be selected
     :param method: random or order
+    :param rng: numpy Generator of the row, see random_stream
     :return: selected object images
     """
     labels = [index for (index, value) in enumerate(line) if value == 1]
     imgs = []
-    imgs_set = []
+    imgs_set = set()
     max_retry_time = 100
     while num > 0:
         imgs_i = []
-        imgs_tmp = []
+        ids_tmp = []
         for label in labels:
-            if len(matting_img.loc[
-                matting_img["labelid"] == label
-            ]) == 0:
+            if not library.has(label):
                 continue
-            library = matting_img.loc[
-                (matting_img["labelid"] == label) & ((max_time == 0) | (matting_img["count"] < max_time)),
-                ["file", "label"]
-            ]
-            while len(library) == 0:
+            while library.available(label, max_time) == 0:
                 max_time += 1
                 # print("\033[31m" + f"\rWarning: max_times increase to {max_time} due to label {label}" + "\033[0m", end="")
-                library = matting_img.loc[
-                    (matting_img["labelid"] == label) & (matting_img["count"] < max_time),
-                    ["file", "label"]
-                ]
             if method == "random":
-                index = random.randint(0, len(library) - 1)
-                x = library.iloc[index:index + 1]
+                x = library.pick(label, int(rng.integers(library.available(label, max_time))))
             elif method == "order":
-                x = library.iloc[len(imgs) % len(library):len(imgs) % len(library) + 1]
+                x = library.nth(label, max_time, len(imgs))
             else:
                 raise Exception("method error")
-            imgs_i.append((x.iloc[0]["file"], x.iloc[0]["label"]))
-            imgs_tmp.append(x)
-        if set(imgs_i) not in imgs_set:
-            for x in imgs_tmp:
-                matting_img.loc[x.index, "count"] += 1
+            imgs_i.append((library.files[x], library.labels[x]))
+            ids_tmp.append(x)
+        if frozenset(imgs_i) not in imgs_set:
+            library.use(ids_tmp)
             imgs.append(imgs_i)
-            imgs_set.append(set(imgs_i))
+            imgs_set.add(frozenset(imgs_i))
             num -= 1
         else:
             if max_retry_time == 0:
@@ -131,100 +349,318 @@ def select(matting_img: pd.DataFrame, line, num, max_time, method):
     return imgs
 
 
-def scale(img, scale_range):
+def largest_contour(img):
+    """
+    :param img: RGBA image
+    :return: points of the largest contour of the alpha channel, int32 array with shape (m, 2), (row, column) order
     """
-    scale the image randomly
+    contours, _ = cv2.findContours(img[:, :, 3], cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    contour = max(contours, key=lambda c: cv2.contourArea(c))
+    return np.ascontiguousarray(contour[:, 0, ::-1], dtype=np.int32)
 
-    :param img: image
-    :param scale_range: scale range, sr in [sr[0], sr[1])
-    :return: scaled image
-    """
-    scale_min = scale_range[0]
-    scale_max = scale_range[1]
-    s = random.random() * (scale_max - scale_min) + scale_min
-    img = cv2.resize(img, None, fx=s, fy=s)
-    # cv2.imshow(f"scale-{s}", img)
-    # cv2.waitKey(0)
-    return img
-
-
-def angle(img):
-    """
-    rotate the image randomly
-
-    :param img: image
-    :return: rotated image
-    """
-    alpha = random.random() * MAX_ANGLE * 2 - MAX_ANGLE  # [-MAX_ANGLE°, MAX_ANGLE°)
-    # alpha = 0
-    w = img.shape[0]
-    h = img.shape[1]
-    img = imutils.rotate_bound(img, alpha)
-    w_ = img.shape[0]
-    h_ = img.shape[1]
-    w_cosa = w * abs(math.cos(alpha/180*math.pi))
-    w_d_w_cosa = w_ - w_cosa
-    h_cosa = h * abs(math.cos(alpha/180*math.pi))
-    h_d_h_cosa = h_ - h_cosa
-    if alpha < 90 or 180 < alpha < 270:
-        poly = [
-            np.array([[0, 0], [0, w_cosa+1], [h_d_h_cosa+1, 0]], np.int32),
-            np.array([[0, w_], [h_cosa+1, w_], [0, w_cosa-1]], np.int32),
-            np.array([[h_, w_], [h_, w_d_w_cosa-1], [h_cosa-1, w_]], np.int32),
-            np.array([[h_, 0], [h_d_h_cosa-1, 0], [h_, w_d_w_cosa+1]], np.int32),
-        ]
-        vertex = [[w_cosa, 0], [w_, h_cosa], [w_d_w_cosa, h_], [0, h_d_h_cosa]]
-    else:
-        poly = [
-            np.array([[0, 0], [0, w_d_w_cosa+1],  [h_cosa+1, 0]], np.int32),
-            np.array([[0, w_], [h_d_h_cosa+1, w_], [0, w_d_w_cosa-1]], np.int32),
-            np.array([[h_, w_], [h_, w_cosa-1], [h_d_h_cosa, w_-1]], np.int32),
-            np.array([[h_, 0], [h_cosa-1, 0], [h_, w_cosa+1]], np.int32),
-        ]
-        vertex = [[w_d_w_cosa, 0], [w_, h_d_h_cosa], [w_cosa, h_], [0, h_cosa]]
-    cv2.fillPoly(img, poly, (0, 0, 0, 0))
-    return img, vertex
 
+class ObjectStore:
+    """
+    memory-mapped store of decoded object images, the pixels of all images are appended to one flat uint8 file
+    (pixels_<build>.bin, every build writes a new one) and its name and the sizes, mtimes, shapes, offsets and
+    largest contours of the images are written to index.npz, worker processes that open the same store share the
+    pages instead of copying the images
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, "index.npz")) as index:
+            self.files = {file: i for i, file in enumerate(index["files"].tolist())}
+            self.sizes = index["sizes"]
+            self.mtimes = index["mtimes"]
+            self.offsets = index["offsets"]
+            self.shapes = index["shapes"]
+            self.contour_offsets = index["contour_offsets"]
+            self.contours = index["contours"]
+            pixels = str(index["pixels"])
+        if self.offsets[-1]:
+            self.pixels = np.memmap(os.path.join(path, pixels), dtype=np.uint8, mode="r")
+        else:
+            self.pixels = np.zeros(0, dtype=np.uint8)
+
+    def __contains__(self, file):
+        return file in self.files
+
+    def get(self, file):
+        """
+        :return: read-only image (a view of the memory map), largest contour
+        """
+        i = self.files[file]
+        img = self.pixels[self.offsets[i]:self.offsets[i + 1]].reshape(self.shapes[i])
+        return img, self.contours[self.contour_offsets[i]:self.contour_offsets[i + 1]]
+
+    @staticmethod
+    def stats(files):
+        """
+        :return: sizes and mtimes of the files
+        """
+        stats = [os.stat(file) for file in files]
+        return np.array([s.st_size for s in stats], dtype=np.int64), np.array([s.st_mtime for s in stats])
+
+    @staticmethod
+    def build(files, path):
+        """
+        decode the object images into a store at path one after another, an existing store of the same files with
+        the same sizes and mtimes is kept
 
-def get_center_random(polys, poly, shape, overlap_range):
+        :param files: file paths of the object images
+        :return: ObjectStore
+        """
+        files = np.asarray(files, dtype=str)
+        sizes, mtimes = ObjectStore.stats(files)
+        index_path = os.path.join(path, "index.npz")
+        if os.path.exists(index_path):
+            with np.load(index_path) as index:
+                keep = "pixels" in index.files and index["files"].tolist() == files.tolist() and \
+                    np.array_equal(index["sizes"], sizes) and np.array_equal(index["mtimes"], mtimes)
+            if keep:
+                return ObjectStore(path)
+            # a store without index is incomplete
+            os.remove(index_path)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        shapes, contours, offsets = [], [], [0]
+        # a new file instead of replacing the old one, which other stores may still map (and Windows does not
+        # replace or remove a mapped file)
+        pixels = f"pixels_{time.time_ns()}_{os.getpid()}.bin"
+        with open(os.path.join(path, pixels), "wb") as f:
+            for file in files:
+                img = cv2.imread(file, cv2.IMREAD_UNCHANGED)
+                f.write(np.ascontiguousarray(img).data)
+                shapes.append(img.shape)
+                contours.append(largest_contour(img))
+                offsets.append(offsets[-1] + img.size)
+        np.savez(
+            index_path,
+            pixels=pixels, files=files, sizes=sizes, mtimes=mtimes, offsets=np.array(offsets, dtype=np.int64),
+            shapes=np.array(shapes, dtype=np.int64).reshape(-1, 3),
+            contour_offsets=np.concatenate([[0], np.cumsum([len(c) for c in contours])]).astype(np.int64),
+            contours=np.concatenate(contours or [np.zeros((0, 2), np.int32)]),
+        )
+        for name in os.listdir(path):
+            if name.startswith("pixels") and name.endswith(".bin") and name != pixels:
+                try:
+                    os.remove(os.path.join(path, name))
+                except OSError:
+                    # still mapped, removed by a later build
+                    pass
+        return ObjectStore(path)
+
+
+class ObjectCache:
+    """
+    LRU cache of decoded object images with their largest contour and polygon, bounded by the bytes of the
+    decoded images, the images in the attached ObjectStores are memory-mapped and do not count
+
+    :param max_bytes: maximum bytes of the cached images
+    """
+
+    def __init__(self, max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()  # file -> (img, contour, polygon, bytes)
+        self.stores = {}  # path -> ObjectStore
+        self.lock = threading.Lock()
+
+    def attach(self, store: ObjectStore):
+        with self.lock:
+            self.stores[store.path] = store
+
+    def get(self, file):
+        """
+        :return: read-only RGBA image, largest contour, polygon of the contour
+        """
+        with self.lock:
+            if file in self.entries:
+                self.entries.move_to_end(file)
+                return self.entries[file][:3]
+        store = next((store for store in self.stores.values() if file in store), None)
+        if store is not None:
+            img, contour = store.get(file)
+            nbytes = contour.nbytes
+        else:
+            img = cv2.imread(file, cv2.IMREAD_UNCHANGED)
+            img.flags.writeable = False
+            contour = largest_contour(img)
+            nbytes = img.nbytes + contour.nbytes
+        polygon = geometry.Polygon(contour)
+        with self.lock:
+            if file not in self.entries:
+                self.entries[file] = (img, contour, polygon, nbytes)
+                self.bytes += nbytes
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, _, _, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+        return img, contour, polygon
+
+
+OBJECT_CACHE_BYTES = 1 << 30
+object_cache = ObjectCache(OBJECT_CACHE_BYTES)
+_store_lock = threading.Lock()
+
+
+def get_object_store(input_dir, path):
+    """
+    build (or reuse) the ObjectStore of the whole object library under input_dir, so that it serves every model
+
+    :param path: directory of the store
+    :return: ObjectStore
+    """
+    with _store_lock:
+        library, _ = load_library_manifest(input_dir)
+        return ObjectStore.build(library["file"], path)
+
+
+def transform_matrix(shape, s, alpha):
     """
-    get the center of the image randomly
+    affine matrix scaling an image by s and rotating it clockwise by alpha degrees about its center, translated so
+    that the whole transformed image fits in its output
 
-    :param polys: all polygons
-    :param poly: current polygon
     :param shape: shape of the image
-    :param overlap_range: overlap range, or in [or[0], or[1])
-    :return: center of the image
-    """
-    if not poly.is_valid:
-        poly = poly.buffer(0)
-    poly = affinity.translate(poly, -shape[0] / 2, -shape[1] / 2)
-
-    beta = random.random() * 360
-    overlap = random.random() * (overlap_range[1] - overlap_range[0]) + overlap_range[0]
-    rho_min = 0
-    rho_max = 1000
-    while rho_max - rho_min > 1:
-        center_min = [rho_min * math.cos(beta), rho_min * math.sin(beta)]
-        center_max = [rho_max * math.cos(beta), rho_max * math.sin(beta)]
-        poly_min = affinity.translate(poly, center_min[0], center_min[1])
-        poly_max = affinity.translate(poly, center_max[0], center_max[1])
-        intersects_min = polys.intersects(poly_min)
-        intersects_max = polys.intersects(poly_max)
-        if intersects_min and intersects_max:
-            rho_min, rho_max = rho_max, rho_max * 2 - rho_min
-        elif intersects_min and not intersects_max:
-            rho_min, rho_max = (rho_min + rho_max) / 2, rho_max
-        elif not intersects_min and intersects_max:
-            rho_min, rho_max = rho_min, (rho_min + rho_max) / 2
-        elif not intersects_min and not intersects_max:
-            rho_min, rho_max = max(rho_min * 2 - rho_max, 0), rho_min
-        # print(rho_min, rho_max)
-    rho_max = rho_max * (1 - overlap)
-    center = [int(rho_max * math.cos(beta)), int(rho_max * math.sin(beta))]
-    # print(f"center: {center}")
-
-    return center, affinity.translate(poly, center[0], center[1])
+    :param s: scale
+    :param alpha: angle in degrees
+    :return: 2x3 matrix (on (column, row) points, as cv2.warpAffine), shape (rows, columns) of the output
+    """
+    h, w = shape[0], shape[1]
+    cos, sin = abs(math.cos(math.radians(alpha))), abs(math.sin(math.radians(alpha)))
+    out_h, out_w = int(round((h * cos + w * sin) * s)), int(round((w * cos + h * sin) * s))
+    # the centers are those of the pixel grids, so that a scaling alone matches cv2.resize
+    matrix = cv2.getRotationMatrix2D(((w - 1) / 2, (h - 1) / 2), -alpha, s)
+    matrix[:, 2] += [(out_w - w) / 2, (out_h - h) / 2]
+    return matrix, (out_h, out_w)
+
+
+def warp(img, matrix, shape):
+    """
+    :param img: RGBA image, the alpha channel is warped with the colors so that the pixels out of the image are
+    transparent
+    :return: warped image
+    """
+    return cv2.warpAffine(
+        img, matrix, (shape[1], shape[0]), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0
+    )
+
+
+def transform_points(points, matrix):
+    """
+    :param points: (m, 2) (row, column) points, e.g. a contour of largest_contour
+    :return: (m, 2) float (row, column) points transformed by the matrix of transform_matrix
+    """
+    return (points[:, ::-1] @ matrix[:, :2].T + matrix[:, 2])[:, ::-1]
+
+
+def augment(img, contour, scale_range, do_scale, do_angle, rng):
+    """
+    scale and rotate an object image randomly in a single warp, its contour is transformed by the same matrix
+    instead of being found again in the warped image
+
+    :param img: RGBA image
+    :param contour: largest contour of the image, see largest_contour
+    :param scale_range: scale range, sr in [sr[0], sr[1])
+    :param do_scale: whether to scale
+    :param do_angle: whether to rotate, by an angle in [-MAX_ANGLE°, MAX_ANGLE°)
+    :param rng: numpy Generator
+    :return: transformed image, polygon of the transformed contour
+    """
+    s = rng.random() * (scale_range[1] - scale_range[0]) + scale_range[0] if do_scale else 1
+    alpha = rng.random() * MAX_ANGLE * 2 - MAX_ANGLE if do_angle else 0
+    matrix, shape = transform_matrix(img.shape, s, alpha)
+    return warp(img, matrix, shape), geometry.Polygon(transform_points(contour, matrix))
+
+
+def rasterize(poly, cell=PLACEMENT_CELL):
+    """
+    rasterize a polygon into a coarse occupancy grid
+
+    :param poly: polygon (or multipolygon), holes are ignored
+    :param cell: size of a grid cell in pixels
+    :return: (n, 2) array of the coordinates of the occupied cells on the outline, in the coordinates of the polygon
+    """
+    if poly.is_empty:
+        return np.zeros((0, 2))
+    origin = np.floor(poly.bounds[:2])
+    size = (np.ceil(np.array(poly.bounds[2:]) - origin) / cell).astype(int) + 1
+    grid = np.zeros(size, np.uint8)
+    points = [
+        np.round((np.asarray(g.exterior.coords)[:, :2] - origin) / cell).astype(np.int32)[:, ::-1]
+        for g in getattr(poly, "geoms", [poly])
+    ]
+    cv2.fillPoly(grid, points, 1)
+    # only the outline decides where the object touches another one
+    grid -= cv2.erode(grid, np.ones((3, 3), np.uint8), borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    return np.argwhere(grid) * cell + origin
+
+
+class Placement:
+    """
+    occupancy of the objects placed on a test case, the occupied region is kept as the cells of a coarse grid so
+    that the contact radius along a direction is found by projecting the cells instead of bisecting on polygons
+    """
+
+    def __init__(self, cell=PLACEMENT_CELL):
+        self.cell = cell
+        self.occupied = np.zeros((0, 2))
+
+    def contact_radius(self, cells, beta):
+        """
+        the smallest distance along the direction beyond which the object no longer intersects the occupied region
+
+        :param cells: occupied cells of the object centered at the origin, see rasterize
+        :param beta: direction (radians)
+        :return: radius
+        """
+        if not len(self.occupied) or not len(cells):
+            return 0
+        direction = np.array([math.cos(beta), math.sin(beta)])
+        normal = np.array([-direction[1], direction[0]])
+        # cells on the same strip along the direction collide once the object has moved by the gap of their projections
+        strips_occupied = np.floor(self.occupied @ normal / self.cell).astype(np.int64)
+        strips_object = np.floor(cells @ normal / self.cell).astype(np.int64)
+        low = min(strips_occupied.min(), strips_object.min())
+        n = max(strips_occupied.max(), strips_object.max()) - low + 1
+        front = np.full(n, -np.inf)
+        np.maximum.at(front, strips_occupied - low, self.occupied @ direction)
+        back = np.full(n, np.inf)
+        np.minimum.at(back, strips_object - low, cells @ direction)
+        gaps = front - back
+        gaps = gaps[np.isfinite(gaps)]
+        if not len(gaps):
+            return 0
+        return max(gaps.max(), 0)
+
+    @staticmethod
+    def centered(poly, shape):
+        """
+        :return: the polygon moved so that the center of its image is the origin
+        """
+        if not poly.is_valid:
+            poly = poly.buffer(0)
+        return affinity.translate(poly, -shape[0] / 2, -shape[1] / 2)
+
+    def place_all(self, objects, overlap_range, rng):
+        """
+        place all objects of a test case one after another, the objects are rasterized before any of them is placed
+
+        :param objects: list of (polygon, shape of the image)
+        :param overlap_range: overlap range, or in [or[0], or[1])
+        :param rng: numpy Generator of the directions and overlaps
+        :return: list of the centers of the images
+        """
+        cells = [rasterize(self.centered(poly, shape), self.cell) for poly, shape in objects]
+        return [self._place(c, overlap_range, rng) for c in cells]
+
+    def _place(self, cells, overlap_range, rng):
+        beta = rng.random() * 360
+        overlap = rng.random() * (overlap_range[1] - overlap_range[0]) + overlap_range[0]
+        rho = self.contact_radius(cells, beta) * (1 - overlap)
+        center = [int(rho * math.cos(beta)), int(rho * math.sin(beta))]
+        self.occupied = np.concatenate([self.occupied, cells + center])
+        return center
 
 
 def get_background(size_x, size_y):
@@ -237,49 +673,197 @@ def get_background(size_x, size_y):
     return background_img
 
 
-def paste_img(src, dst, center, translation_x, translation_y):
+def paste_alpha(src, mode=PASTE_MODE):
+    """
+    alpha of the image prepared for paste_img, so that an image pasted several times is prepared once
+
+    :param src: BGRA image
+    :param mode: see paste_img
+    :return: (h, w) alpha, the alpha byte repeated in uint32 for bitwise, bool for mask, float32 in [0, 1] for alpha
+    """
+    if mode == "bitwise":
+        return src[:, :, 3].astype(np.uint32) * 0x01010101
+    if mode == "mask":
+        return src[:, :, 3] > 0
+    if mode == "alpha":
+        return src[:, :, 3].astype(np.float32) / 255
+    raise Exception(f"unknown paste mode: {mode}")
+
+
+def pixels(img):
+    """
+    :return: (h, w) uint32 view of a BGRA image, one word per pixel
+    """
+    return img.view(np.uint32)[:, :, 0]
+
+
+def paste_img(src, dst, center, translation_x, translation_y, mode=PASTE_MODE, alpha=None):
+    """
+    paste the image on dst in place
+
+    :param src: BGRA image
+    :param dst: BGRA canvas
+    :param center: center of src on the canvas before the translation
+    :param mode: bitwise: every bit of src is taken where the bit of its alpha is set (the original blend),
+                 mask: src is taken where its alpha is not 0, alpha: src is blended over dst by its alpha
+    :param alpha: alpha of src returned by paste_alpha for the mode, computed if None
+    """
     x1 = center[0] - math.floor(src.shape[0] / 2) - translation_x
     x2 = center[0] + math.ceil(src.shape[0] / 2) - translation_x
     y1 = center[1] - math.floor(src.shape[1] / 2) - translation_y
     y2 = center[1] + math.ceil(src.shape[1] / 2) - translation_y
-    b_channel, g_channel, r_channel, a_channel = cv2.split(src)
-    b_channel2, g_channel2, r_channel2, a_channel2 = cv2.split(dst[x1:x2, y1:y2])
-    dst[x1:x2, y1:y2] = cv2.merge([
-        np.bitwise_or(np.bitwise_and(b_channel, a_channel), np.bitwise_and(b_channel2, np.bitwise_not(a_channel))),
-        np.bitwise_or(np.bitwise_and(g_channel, a_channel), np.bitwise_and(g_channel2, np.bitwise_not(a_channel))),
-        np.bitwise_or(np.bitwise_and(r_channel, a_channel), np.bitwise_and(r_channel2, np.bitwise_not(a_channel))),
-        np.bitwise_or(a_channel, a_channel2)
-    ])
-
-
-def compare(img1, img2):
-    if img1 is None or img2 is None:
-        raise Exception(f"{'img1' if img2 else 'img2'} is None")
-    detector = cv2.ORB_create()
-    _, descriptors1 = detector.detectAndCompute(img1, None)
-    _, descriptors2 = detector.detectAndCompute(img2, None)
-    matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    region = dst[x1:x2, y1:y2]
+    if alpha is None:
+        alpha = paste_alpha(src, mode)
+    if mode == "bitwise":
+        # (src & a) | (dst & ~a) on all channels at once, which also gives a | a2 on the alpha channel
+        region = pixels(region)
+        np.bitwise_and(region, np.bitwise_not(alpha), out=region)
+        np.bitwise_or(region, np.bitwise_and(pixels(src), alpha), out=region)
+    elif mode == "mask":
+        np.copyto(pixels(region), pixels(src), where=alpha)
+    elif mode == "alpha":
+        weight = region[:, :, 3] * ((1 - alpha) / 255)
+        region[:] = cv2.blendLinear(src, region, alpha, weight)
+        region[:, :, 3] = np.rint((alpha + weight) * 255)
+    else:
+        raise Exception(f"unknown paste mode: {mode}")
+
+
+def paste_imgs(srcs, dst, translation_x, translation_y, mode=PASTE_MODE, alphas=None):
+    """
+    paste a batch of images on dst in place, in the order of the batch
+
+    :param srcs: list of (center, image), see paste_img
+    :param alphas: alphas of the images returned by paste_alpha, computed if None
+    :return: dst
+    """
+    if alphas is None:
+        alphas = [paste_alpha(img, mode) for _, img in srcs]
+    for (center, img), alpha in zip(srcs, alphas):
+        paste_img(img, dst, center, translation_x, translation_y, mode, alpha)
+    return dst
+
+
+def orb_descriptors(img):
+    """
+    :return: ORB descriptors of the image, None if it has no keypoint
+    """
+    if img is None:
+        raise Exception("img is None")
+    return cv2.ORB_create().detectAndCompute(img, None)[1]
+
+
+def orb_distance(descriptors1, descriptors2):
+    """
+    mean Hamming distance from every descriptor of the first image to its nearest descriptor of the second one
+
+    :return: distance, 0 if an image has no descriptor
+    """
     if descriptors1 is None or descriptors2 is None:
         return 0
-    matches = matcher.match(descriptors1, descriptors2)
-    distance = sum([match.distance for match in matches]) / len(matches)
-    return distance
+    distances, _ = cv2.batchDistance(descriptors1, descriptors2, cv2.CV_32S, normType=cv2.NORM_HAMMING, K=1)
+    return int(distances.sum()) / len(distances)
+
 
+def embedding(img, method):
+    """
+    cheap embedding of an image for distance_matrix
 
-def composite(output_dir, combs, select_num, scale_range, overlap_range, final_size, do_scale, do_angle):
+    :param method: hist: normalized 8x8x8 color histogram, phash: 64 bits perceptual hash (sign of the low DCT
+                   frequencies against their median)
     """
-    composite images
+    if method == "hist":
+        hist = cv2.calcHist([img], [0, 1, 2], None, [8, 8, 8], [0, 256] * 3).ravel()
+        return hist / max(hist.sum(), 1)
+    if method == "phash":
+        gray = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+        low = cv2.dct(cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32))[:8, :8].ravel()
+        return low > np.median(low)
+    raise Exception(f"unknown sample distance: {method}")
 
 
-    :param output_dir: output directory
+def distance_matrix(imgs, method=SAMPLE_DISTANCE, threads=SAMPLE_THREADS):
+    """
+    pairwise distances of the images
+
+    :param imgs: list of images
+    :param method: orb: orb_distance of every pair (i < j), with the descriptors of every image extracted once,
+                   hist: L1 distance of the color histograms, phash: Hamming distance of the perceptual hashes
+    :param threads: threads extracting the descriptors and matching the pairs for orb, 0: the calling thread
+    :return: symmetric (m, m) array with a zero diagonal
+    """
+    m = len(imgs)
+    if method == "orb":
+        pairs = list(zip(*np.triu_indices(m, 1)))
+        with ThreadPoolExecutor(threads) if threads else contextlib.nullcontext() as pool:
+            mapper = pool.map if threads else map
+            descriptors = list(mapper(orb_descriptors, imgs))
+            values = list(mapper(lambda pair: orb_distance(descriptors[pair[0]], descriptors[pair[1]]), pairs))
+        distances = np.zeros((m, m))
+        if pairs:
+            distances[tuple(np.array(pairs).T)] = values
+        return distances + distances.T
+    features = np.array([embedding(img, method) for img in imgs])
+    if method == "hist":
+        return np.abs(features[:, None] - features[None]).sum(axis=2)
+    return (features[:, None] != features[None]).sum(axis=2).astype(float)
+
+
+def farthest_points(distances, num):
+    """
+    select the two farthest images first, then one by one the image farthest from the selected ones on average
+
+    :param distances: distance matrix, see distance_matrix
+    :param num: number of images to select
+    :return: indices of the selected images in the order of selection
+    """
+    pairs = np.triu_indices(len(distances), 1)
+    first = np.argmax(distances[pairs])
+    selected = [pairs[0][first], pairs[1][first]]
+    total = distances[selected[0]] + distances[selected[1]]
+    for _ in range(num - 2):
+        score = total / len(selected)
+        score[selected] = -np.inf
+        selected.append(np.argmax(score))
+        total = total + distances[selected[-1]]
+    return [int(i) for i in selected[:num]]
+
+
+def covering_array_key(array):
+    """
+    :param array: covering array, see CoveringArrayStore.read
+    :return: integer key of a covering array, from the hash of its rows so that it does not depend on where or
+             under which name it is stored, while arrays of the same name in different stores get different keys
+    """
+    return int(array_digest(array), 16)
+
+
+def random_stream(seed, *key):
+    """
+    random numbers of a (covering array, row[, sample]) key, the same key always gives the same numbers whatever
+    thread or worker process draws them, and different keys give independent streams
+
+    :param seed: seed given by the user
+    :param key: integers, see covering_array_key
+    :return: numpy Generator
+    """
+    return np.random.default_rng(np.random.SeedSequence([seed, *key]))
+
+
+def composite_candidates(combs, scale_range, overlap_range, final_size, do_scale, do_angle, key=None):
+    """
+    composite the candidate images of a covering array row
+
     :param combs: all combinations (2D array, each row is a group of images, each value in group is a file path of an image)
-    :param select_num: number of selected images
     :param scale_range: scale range, e.g., (0.5, 1.5)
     :param overlap_range: overlap range, e.g., (0, 0.3)
     :param final_size: final image size
     :param do_scale: whether to scale
     :param do_angle: whether to rotate
-    :return: None
+    :param key: (seed, covering array key, row) of the row, the j-th combination is composited with
+    random_stream(*key, j), default unseeded streams
+    :return: labels, composite images, components, components labels (by id of the composite image)
     """
 
     labels = sorted([label for _, label in combs[0]])
@@ -287,25 +871,19 @@ def composite(output_dir, combs, select_num, scale_range, overlap_range, final_s
     composite_imgs = {}
     components = {}
     components_labels = {}
-    for comb in combs:
-        centers = []
-        # calculate the center of each object
-        polys = geometry.Polygon()
-        np.random.shuffle(comb)
+    for j, comb in enumerate(combs):
+        rng = random_stream(*key, j) if key is not None else np.random.default_rng()
+        imgs = []
+        objects = []
+        rng.shuffle(comb)
         for img_file, _ in comb:
-            img = cv2.imread(img_file, cv2.IMREAD_UNCHANGED)
-            if do_scale:
-                img = scale(img, scale_range)
-            if do_angle:
-                img, _ = angle(img)
-            contours, _ = cv2.findContours(img[:, :, 3], cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-            contours.sort(key=lambda c: cv2.contourArea(c), reverse=True)
-            points = []
-            for point in contours[0]:
-                points.append([point[0][1], point[0][0]])
-            center, poly = get_center_random(polys, geometry.Polygon(points), img.shape[0:2], overlap_range)
-            polys = polys.union(poly)
-            centers.append([center, img])
+            img, contour, poly = object_cache.get(img_file)
+            if do_scale or do_angle:
+                img, poly = augment(img, contour, scale_range, do_scale, do_angle, rng)
+            imgs.append(img)
+            objects.append((poly, img.shape[0:2]))
+        # calculate the center of each object
+        centers = [list(c) for c in zip(Placement().place_all(objects, overlap_range, rng), imgs)]
 
         # paste images on the background
         if len(centers) == 0:
@@ -316,9 +894,8 @@ def composite(output_dir, combs, select_num, scale_range, overlap_range, final_s
             max_x = max([center[0] + math.ceil(img.shape[0] / 2) - translation_x for center, img in centers])
             max_y = max([center[1] + math.ceil(img.shape[1] / 2) - translation_y for center, img in centers])
 
-            final_img = get_background(max_x, max_y)
-            for center, img in centers:
-                paste_img(img, final_img, center, translation_x, translation_y)
+            alphas = [paste_alpha(img) for _, img in centers]
+            final_img = paste_imgs(centers, get_background(max_x, max_y), translation_x, translation_y, alphas=alphas)
 
             if final_img.shape[0] > final_img.shape[1]:
                 final_size_x = final_size
@@ -329,7 +906,7 @@ def composite(output_dir, combs, select_num, scale_range, overlap_range, final_s
             final_img = cv2.resize(final_img, (final_size_y, final_size_x))
 
             while True:
-                id = '%05d' % random.randint(10000, 99999)
+                id = '%05d' % rng.integers(10000, 100000)
                 if id not in composite_imgs:
                     break
             composite_imgs[id] = final_img
@@ -338,96 +915,328 @@ def composite(output_dir, combs, select_num, scale_range, overlap_range, final_s
                 components[id] = {}
                 components_labels[id] = {}
                 for i in range(1, len(centers)):
-                    for comb in combinations(centers, i):
-                        tmp_img = get_background(max_x, max_y)
-                        for center, img in comb:
-                            paste_img(img, tmp_img, center, translation_x, translation_y)
-                        idxes = [centers.index([center, img]) for center, img in comb]
+                    for idxes in combinations(range(len(centers)), i):
+                        tmp_img = paste_imgs(
+                            [centers[idx] for idx in idxes], get_background(max_x, max_y),
+                            translation_x, translation_y, alphas=[alphas[idx] for idx in idxes]
+                        )
                         components[id]["".join(sorted([str(idx) for idx in idxes]))] = tmp_img
                         components_labels[id]["".join(sorted([str(idx) for idx in idxes]))] = [labels[idx] for idx in idxes]
 
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-    sample_and_save(output_dir, composite_imgs, labels, select_num, components, components_labels)
-    return
+    return labels, composite_imgs, components, components_labels
 
 
-def sample_and_save(output_dir, composite_imgs, labels, select_num, components=None, components_labels=None):
+def composite(
+        output_dir, combs, select_num, scale_range, overlap_range, final_size, do_scale, do_angle,
+        prefix=None, append_info=True, models=None, valid=None, suite=None, key=None
+):
     """
-    sample images
+    composite images, sample and save them
 
     :param output_dir: output directory
-    :param composite_imgs: composite images
-    :param labels: labels
+    :param combs: all combinations, see composite_candidates
     :param select_num: number of selected images
-    :param components: components
-    :param components_labels: components labels
-    :return: None
+    :param prefix: prefix of the file names, see save_imgs
+    :param append_info: append the info of the saved images to info.csv, see save_imgs
+    :param models: if not None, sample select_num images for every model, see composite_and_sample
+    :param valid: for every combination, the bitmask of the models it is valid for, see valid_models
+    :param suite: see save_imgs
+    :param key: (seed, covering array key, row) of the random streams, see composite_candidates
+    :return: info rows of the saved images and of their components
     """
-    # sample
-    if len(composite_imgs) > select_num:
-        distances = {id: defaultdict(dict) for id in composite_imgs.keys()}
-        max_distance = 0
-        max_distance_ids = []
-        for id1, id2 in combinations(composite_imgs.keys(), 2):
-            # id1, id2 = id1, id2 if id1 < id2 else id2, id1
-            distance = compare(composite_imgs[id1], composite_imgs[id2])
-            distances[id1][id2] = distance
-            distances[id2][id1] = distance
-            if distance > max_distance:
-                max_distance = distance
-                max_distance_ids = [id1, id2]
-
-        selected_ids = max_distance_ids
-        for _ in range(select_num - 2):
-            max_distance = 0
-            max_distance_id = ""
-            for id in composite_imgs.keys():
-                if id in selected_ids:
-                    continue
-                distance = sum([distances[id][id_] for id_ in selected_ids]) / len(selected_ids)
-                if distance > max_distance:
-                    max_distance = distance
-                    max_distance_id = id
-            selected_ids.append(max_distance_id)
+    labels, imgs, components, components_labels, tags = composite_and_sample(
+        combs, select_num, scale_range, overlap_range, final_size, do_scale, do_angle, models, valid, key
+    )
+    return save_imgs(output_dir, imgs, labels, components, components_labels, prefix, append_info, tags, suite)
+
+
+def composite_and_sample(
+        combs, select_num, scale_range, overlap_range, final_size, do_scale, do_angle, models=None, valid=None,
+        key=None
+):
+    """
+    composite the candidate images of a covering array row and keep only the sampled ones
+
+    :param models: if not None, the images are sampled for every model among the images valid for it, and tagged
+    with the models they are sampled for
+    :param valid: for every combination, the bitmask of the models it is valid for, see valid_models
+    :param key: (seed, covering array key, row) of the random streams, see composite_candidates
+    :return: labels, sampled images, their components and components labels, their models (None without models),
+    see save_imgs
+    """
+    labels, composite_imgs, components, components_labels = composite_candidates(
+        combs, scale_range, overlap_range, final_size, do_scale, do_angle, key
+    )
+    tags = None
+    if models:
+        # one composite image per combination, in the order of the combinations
+        selected = sample_models(composite_imgs, select_num, valid[:len(composite_imgs)], models)
+        ids = list(selected)
+        tags = {id: model_names(mask, models) for id, mask in selected.items()}
     else:
-        selected_ids = composite_imgs.keys()
+        ids = sample(composite_imgs, select_num)
+    if DO_COMPONENTS:
+        components = {id: components[id] for id in ids}
+        components_labels = {id: components_labels[id] for id in ids}
+    return labels, {id: composite_imgs[id] for id in ids}, components, components_labels, tags
+
+
+def sample(composite_imgs, select_num):
+    """
+    sample the most diverse images, see farthest_points
+
+    :param composite_imgs: composite images by id
+    :param select_num: number of selected images
+    :return: ids of the selected images
+    """
+    ids = list(composite_imgs.keys())
+    if len(ids) <= select_num:
+        return ids
+    distances = distance_matrix([composite_imgs[id] for id in ids])
+    return [ids[i] for i in farthest_points(distances, select_num)]
+
+
+def sample_models(composite_imgs, select_num, valid, models):
+    """
+    sample the most diverse images for every model among the images valid for it, the distances of the images are
+    computed once for all the models
+
+    :param composite_imgs: composite images by id
+    :param select_num: number of selected images for every model
+    :param valid: for every image (in order), the bitmask of the models it is valid for, see valid_models
+    :param models: list of models
+    :return: ids of the images selected for any model -> bitmask of the models they are selected for
+    """
+    ids = list(composite_imgs.keys())
+    valid = np.array(valid, dtype=np.int64)
+    selected = np.zeros(len(ids), dtype=np.int64)
+    distances = None
+    for i in range(len(models)):
+        candidates = np.flatnonzero(valid >> i & 1)
+        if len(candidates) > select_num:
+            if distances is None:
+                distances = distance_matrix([composite_imgs[id] for id in ids])
+            candidates = candidates[farthest_points(distances[np.ix_(candidates, candidates)], select_num)]
+        selected[candidates] |= 1 << i
+    return {ids[j]: int(selected[j]) for j in np.flatnonzero(selected)}
+
+
+def encode_img(img, img_format=None):
+    """
+    encode an image for its file
+
+    :param img: BGRA image
+    :param img_format: png (at PNG_COMPRESSION), webp (lossless) or npy (raw RGB array, the alpha is dropped as the
+    loaders do when they convert an image to RGB), default IMG_FORMAT
+    :return: bytes of the file
+    """
+    img_format = img_format or IMG_FORMAT
+    if img_format == "png":
+        params = [] if PNG_COMPRESSION is None else [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+        return cv2.imencode(".png", img, params)[1].tobytes()
+    if img_format == "webp":
+        # a quality above 100 is lossless
+        return cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, 101])[1].tobytes()
+    if img_format == "npy":
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(img[:, :, 2::-1]))
+        return buffer.getvalue()
+    raise Exception(f"unknown image format: {img_format}")
 
+
+_encode_pool = (None, None)
+_encode_pool_lock = threading.Lock()
+
+
+def encode_pool():
+    """
+    :return: the thread pool encoding the images of this process, a new one in a forked worker process
+    """
+    global _encode_pool
+    with _encode_pool_lock:
+        pid, pool = _encode_pool
+        if pid != os.getpid():
+            pool = ThreadPoolExecutor(ENCODE_WORKERS, thread_name_prefix="encode")
+            _encode_pool = (os.getpid(), pool)
+        return pool
+
+
+def write_img(path, img):
+    data = encode_img(img)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_imgs(files):
+    """
+    encode and write images in the encode pool, see encode_img
+
+    :param files: list of (path, image)
+    """
+    if ENCODE_WORKERS and len(files) > 1:
+        list(encode_pool().map(lambda file: write_img(*file), files))
+    else:
+        for path, img in files:
+            write_img(path, img)
+
+
+def save_imgs(
+        output_dir, imgs, labels, components=None, components_labels=None, prefix=None, append_info=True, models=None,
+        suite=None
+):
+    """
+    save images and their components
+
+    :param imgs: images by id
+    :param components: components by id of the image
+    :param components_labels: components labels by id of the image
+    :param prefix: prefix of the file names, default the current time in ms
+    :param append_info: append the info of the saved images to info.csv, otherwise it is only returned
+    :param models: if not None, "|" joined models by id of the image, saved in a models column of the info
+    :param suite: if not None, function (components, filename, RGB image, labels, models) taking the images instead
+    of writing them to files, see SuiteWriter.add
+    :return: info rows of the saved images and of their components
+    """
     # save images
-    for id in selected_ids:
-        image = composite_imgs[id]
+    info_rows, components_rows, files = [], [], []
+    extension = IMG_EXTENSIONS[IMG_FORMAT]
+    for id, image in imgs.items():
         # id = '%05d' % random.randint(10000, 99999)
-        filename = f"{int(time.time() * 1000)}_{id}.png"
-        cv2.imwrite(os.path.join(output_dir, filename), image)
-        with open(os.path.join(output_dir, "info.csv"), "a", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=["filename", "labels"])
-            writer.writerow({"filename": filename, "labels": "|".join(labels)})
+        filename = f"{prefix if prefix is not None else int(time.time() * 1000)}_{id}{extension}"
+        tag = {} if models is None else {"models": models[id]}
+        if suite is not None:
+            suite(False, filename, cv2.cvtColor(image, cv2.COLOR_BGRA2RGB), labels, tag.get("models"))
+        else:
+            files.append((os.path.join(output_dir, filename), image))
+        info_rows.append({"filename": filename, "labels": "|".join(labels), **tag})
 
         if DO_COMPONENTS:
-            components_name = {}
             for idx, img in components[id].items():
-                cv2.imwrite(os.path.join(output_dir, "components", f"{filename.split('.')[0]}-{idx}.png"), img)
-                components_name[idx] = f"{filename.split('.')[0]}-{idx}.png"
+                component_name = f"{filename.split('.')[0]}-{idx}{extension}"
+                if suite is not None:
+                    suite(True, component_name, cv2.cvtColor(img, cv2.COLOR_BGRA2RGB), components_labels[id][idx],
+                          tag.get("models"))
+                else:
+                    files.append((os.path.join(output_dir, "components", component_name), img))
+                components_rows.append(
+                    {"filename": component_name, "labels": "|".join(sorted(components_labels[id][idx])), **tag}
+                )
+    write_imgs(files)
+    if append_info and info_rows:
+        with open(os.path.join(output_dir, "info.csv"), "a", newline="") as f:
+            csv.DictWriter(f, fieldnames=list(info_rows[0])).writerows(info_rows)
+        if DO_COMPONENTS:
             with open(os.path.join(output_dir, "components", "info.csv"), "a", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=["filename", "labels"])
-                rows = [
-                    {"filename": components_name[idx], "labels": "|".join(sorted(components_labels[id][idx]))}
-                    for idx in components[id].keys()
-                ]
-                writer.writerows(rows)
-    return
+                csv.DictWriter(f, fieldnames=list(info_rows[0])).writerows(components_rows)
+    return info_rows, components_rows
+
+
+_END = object()
+
+
+def pipeline(source, stages, depth=PIPELINE_DEPTH):
+    """
+    stream the items of source through the stages, every stage runs in its own thread and is connected to the
+    next one by a queue of at most depth items, so that at most about depth items per stage are held at once
+
+    :param source: iterable of the items, consumed in the calling thread
+    :param stages: functions applied one after another to every item, in the order of the items
+    :param depth: size of the queues
+    :return: results of the last stage in the order of the items
+    """
+    queues = [queue.Queue(depth) for _ in stages]
+    results = []
+    errors = []
+
+    def run(i, stage):
+        output = queues[i + 1].put if i + 1 < len(stages) else results.append
+        while True:
+            item = queues[i].get()
+            if item is _END:
+                break
+            if errors:
+                # keep draining after a failure so that the previous stage never blocks
+                continue
+            try:
+                output(stage(item))
+            except BaseException as e:
+                errors.append(e)
+        if i + 1 < len(stages):
+            queues[i + 1].put(_END)
+
+    threads = [threading.Thread(target=run, args=(i, stage), daemon=True) for i, stage in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+    try:
+        for item in source:
+            if errors:
+                break
+            queues[0].put(item)
+    finally:
+        queues[0].put(_END)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def write_info(output_dir, info_rows, components_rows=(), fieldnames=("filename", "labels")):
+    """
+    append the info rows of the saved images (and of their components) to info.csv at once
+    """
+    with open(os.path.join(output_dir, "info.csv"), "a", newline="") as f:
+        csv.DictWriter(f, fieldnames=fieldnames).writerows(info_rows)
+    if DO_COMPONENTS:
+        with open(os.path.join(output_dir, "components", "info.csv"), "a", newline="") as f:
+            csv.DictWriter(f, fieldnames=fieldnames).writerows(components_rows)
+
+
+_worker_library = None
+
+
+def init_worker(files, labels, object_store=None):
+    """
+    initializer of the compositing processes, the object library is sent once to every worker
+
+    :param object_store: path of the ObjectStore of the library, opened (memory-mapped) by every worker
+    """
+    global _worker_library
+    _worker_library = (files, labels)
+    if object_store:
+        object_cache.attach(ObjectStore(object_store))
+
+
+def composite_row(row, key, combs, output_dir, *args, models=None, valid=None, to_suite=False):
+    """
+    composite the images of a covering array row in a worker process, the object images are given by their
+    file ids in the library of the worker
+
+    :param key: (seed, covering array key, row) of the random streams, see composite_candidates
+    :param to_suite: return the images for the suite of the main process instead of writing them
+    :return: row, info rows of the saved images and of their components, images for the suite (see save_imgs)
+    """
+    files, labels = _worker_library
+    combs = [[(files[i], labels[i]) for i in comb] for comb in combs]
+    packed = []
+    info_rows, components_rows = composite(
+        output_dir, combs, *args, prefix=f"{row:05d}", append_info=False, models=models, valid=valid,
+        suite=(lambda *item: packed.append(item)) if to_suite else None, key=key,
+    )
+    return row, info_rows, components_rows, packed
 
 
 def img_composite(
         covering_array_file, input_dir, output_dir, num, sample_times,
         max_times, scale_range, overlap_range, final_size,
         do_scale=False, do_angle=False, select_order="random",
-        model=None,
+        model=None, workers=0, seed=0, object_store=None,
 ):
     """
-    main def for combining images
+    main def for combining images, the rows are streamed through selection, compositing & sampling and saving, and
+    info.csv is written once at the end in the order of the rows
 
-    :param covering_array_file: file path of covering array
+    :param covering_array_file: file path of covering array, a .npz file of the store or an old .csv file
     :param input_dir: directory of object images
     :param output_dir: directory of composite images
     :param num: number of images in each test case
@@ -439,50 +1248,99 @@ def img_composite(
     :param do_scale: whether to scale
     :param do_angle: whether to rotate
     :param select_order: select order, random or order
-    :param model: model name if not None, select images for specified model
+    :param model: model name if not None, select images for specified model, if a list of models, composite once
+    for all of them: the objects passing any model are selected, num images are sampled for every model among the
+    images whose objects all pass it, and info.csv tells the models of every image in a models column
+    :param workers: if > 0, composite the rows in a pool of this many processes, and write info.csv in the order
+    of the rows at the end
+    :param seed: seed of the random streams, the selection of every row and the compositing of every sample of it
+    draw from their own stream (see random_stream), so the images are the same whatever the threads and workers
+    :param object_store: if not None, directory of the ObjectStore of the library, which is built if needed and
+    shared (memory-mapped) by all threads and worker processes
     :return: None
     """
     if os.path.exists(output_dir):
         print(f"{output_dir} exists")
         return
     matting_img, label = get_matting_img(input_dir, model)
+    library = ObjectLibrary(matting_img)
+    if object_store:
+        object_cache.attach(get_object_store(input_dir, object_store))
     # print(matting_img)
     names = output_dir.split(os.sep)
-    array = pd.read_csv(covering_array_file, usecols=range(label))
-    tqdm.pandas(
-        desc=f"{threading.currentThread().name}({names[-2]}-{names[-1]}): Selecting matting image for every line...",
-        mininterval=10
-    )
-    start = time.process_time()
-    array["img"] = array.progress_apply(
-        lambda x: select(matting_img, x, num * sample_times, max_times, select_order),
-        axis=1,
-    )  # select sample_times*num combinations and than sample num composite images
-    end = time.process_time()
-    print(f"selected, time:{end - start}")
+    array = CoveringArrayStore.read(covering_array_file).iloc[:, :label]
     start = time.process_time()
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
+    models = None if model is None or isinstance(model, str) else list(model)
+    masks = dict(zip(library.files, matting_img["models"])) if models else None
+    fieldnames = ["filename", "labels"] + (["models"] if models else [])
     with open(os.path.join(output_dir, "info.csv"), "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=["filename", "labels"])
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
     if DO_COMPONENTS:
         if not os.path.exists(os.path.join(output_dir, "components")):
             os.makedirs(os.path.join(output_dir, "components"))
         with open(os.path.join(output_dir, "components", "info.csv"), "w", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=["filename", "labels"])
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
-    # composite, sample & save
-    tqdm.pandas(
-        desc=f"{threading.currentThread().name}({names[-2]}-{names[-1]}): Combining...",
-        mininterval=10
+    ca_key = covering_array_key(array)
+    lines = tqdm(
+        array.iterrows(), total=len(array), mininterval=10,
+        desc=f"{threading.currentThread().name}({names[-2]}-{names[-1]}): Selecting & combining...",
     )
-    array.progress_apply(
-        lambda x: composite(
-            output_dir, x["img"], num, scale_range, overlap_range, final_size, do_scale, do_angle
-        ),
-        axis=1,
+    # select sample_times*num combinations for every row, one row after another, and than sample num composite images
+    selections = (
+        (row, select(library, line, num * sample_times, max_times, select_order, random_stream(seed, ca_key, row)))
+        for row, (_, line) in enumerate(lines)
     )
+    if models:
+        selections = ((row, combs, valid_models(combs, masks, models)) for row, combs in selections)
+    else:
+        selections = ((row, combs, None) for row, combs in selections)
+    args = (num, scale_range, overlap_range, final_size, do_scale, do_angle)
+    info_rows, components_rows = [], []
+    suites = []
+    if IMG_FORMAT == "suite":
+        suites = [SuiteWriter(output_dir)] + ([SuiteWriter(os.path.join(output_dir, "components"))] if DO_COMPONENTS else [])
+    suite = (lambda components, *item: suites[components].add(*item)) if suites else None
+    # composite, sample & save
+    if workers:
+        file_ids = {file: i for i, file in enumerate(library.files)}
+        pending = deque()
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(library.files, library.labels, object_store)) as pool:
+            for row, combs, valid in selections:
+                ids = [[file_ids[file] for file, _ in comb] for comb in combs]
+                pending.append(pool.submit(
+                    composite_row, row, (seed, ca_key, row), ids, output_dir, *args, models=models, valid=valid,
+                    to_suite=suite is not None,
+                ))
+                while len(pending) > workers * PIPELINE_DEPTH or (pending and pending[0].done()):
+                    _, rows, comp_rows, packed = pending.popleft().result()
+                    info_rows += rows
+                    components_rows += comp_rows
+                    for item in packed:
+                        suite(*item)
+            for future in pending:
+                _, rows, comp_rows, packed = future.result()
+                info_rows += rows
+                components_rows += comp_rows
+                for item in packed:
+                    suite(*item)
+    else:
+        results = pipeline(selections, [
+            lambda item: (item[0], composite_and_sample(item[1], *args, models, item[2], (seed, ca_key, item[0]))),
+            lambda item: save_imgs(
+                output_dir, item[1][1], item[1][0], item[1][2], item[1][3], f"{item[0]:05d}", append_info=False,
+                models=item[1][4], suite=suite
+            ),
+        ])
+        for rows, comp_rows in results:
+            info_rows += rows
+            components_rows += comp_rows
+    write_info(output_dir, info_rows, components_rows, fieldnames)
+    for writer in suites:
+        writer.close()
     end = time.process_time()
     print(f"\ncomposite done, time:{end - start}")
 
@@ -494,12 +1352,33 @@ if __name__ == "__main__":
         type=str2bool,
         default=False,
     )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=0,
+        help="composite the covering array rows in this many processes, default 0: one thread per covering array"
+    )
+    parser.add_argument("--seed", "-s", type=int, default=0, help="seed of the selection and compositing")
+    parser.add_argument(
+        "--shared", type=str2bool, default=False,
+        help=f"composite once for all the models of a dataset into {SHARED_DIR}, the images are tagged with their models"
+    )
+    parser.add_argument(
+        "--object_store", type=str2bool, default=False,
+        help="decode the object library once into a memory-mapped store (<library directory>_object_store)"
+    )
     args = parser.parse_args()
+    store = CoveringArrayStore(COVERING_ARRAY_DIR)
     if args.demo:
-        ca_file = glob.glob(os.path.join(COVERING_ARRAY_DIR, "adaptive random", "ca_adaptive random*.csv"))[0]
+        arrays = store.find(CA_METHOD, 6, 3, 2, thr=1.0)
+        if not len(arrays):
+            # the array the command of step 1 of the README generates
+            store.get(CA_METHOD, 6, 3, 2, seed=task_seed(0, 6, 3, 2, CA_METHOD, 0))
+            arrays = store.find(CA_METHOD, 6, 3, 2, thr=1.0)
+        ca_file = arrays["path"][0]
         input_dir = os.path.join(MATTING_IMG_DIRS["VOC"])
-        model = "msrn"
-        output_dir = os.path.join(f"{COMPOSITE_IMG_DIRS['VOC']}_{VERSION}", model, "adaptive random_6_3_2_No1")
+        model = MODELS["VOC"] if args.shared else "msrn"
+        output_dir = os.path.join(
+            f"{COMPOSITE_IMG_DIRS['VOC']}_{VERSION}", SHARED_DIR if args.shared else model, "adaptive random_6_3_2_No1"
+        )
         img_composite(
             covering_array_file=ca_file,
             input_dir=input_dir,
@@ -509,9 +1388,12 @@ if __name__ == "__main__":
             do_scale=DO_SCALE, do_angle=DO_ANGLE,
             select_order="random",
             model=model,
+            workers=args.workers, seed=args.seed,
+            object_store=f"{input_dir}_object_store" if args.object_store else None,
         )
     else:
         thread_pool = ThreadPoolExecutor(max_workers=16)
+        jobs = []
         for dataname in DATA_NAMES:
             matting_img_dir = MATTING_IMG_DIRS[dataname]
             composite_img_dir = COMPOSITE_IMG_DIRS[dataname]
@@ -521,15 +1403,17 @@ if __name__ == "__main__":
                 f"{CA_METHOD}_{classes}_{k}_{tau}" for k in [4] for tau in [2]
             ]
             for task in tasks:
-                files = glob.glob(os.path.join(COVERING_ARRAY_DIR, task.split("_")[0], f"ca_{task}*.csv"))
+                method, n, k, tau = task.rsplit("_", 3)
+                files = store.find(method, int(n), int(k), int(tau), thr=1.0)["path"]
                 for i, file in enumerate(files):
                     input_dir = matting_img_dir
-                    for model in MODELS[dataname]:
+                    # with --shared, one composite run serves all the models
+                    for model in [MODELS[dataname]] if args.shared else MODELS[dataname]:
                         # start = time.process_time()
-                        print(f"task \"{model} {task}\" of {matting_img_dir}, {file} No{i+1} start")
-                        output_dir = os.path.join(f"{composite_img_dir}_{VERSION}", model, f"{task}_No{i+1}")
-                        thread_pool.submit(
-                            img_composite,
+                        model_dir = SHARED_DIR if args.shared else model
+                        print(f"task \"{model_dir} {task}\" of {matting_img_dir}, {file} No{i+1} start")
+                        output_dir = os.path.join(f"{composite_img_dir}_{VERSION}", model_dir, f"{task}_No{i+1}")
+                        kwargs = dict(
                             covering_array_file=file,
                             input_dir=input_dir,
                             output_dir=output_dir,
@@ -538,5 +1422,15 @@ if __name__ == "__main__":
                             do_scale=DO_SCALE, do_angle=DO_ANGLE,
                             select_order="random",
                             model=model,
+                            seed=args.seed,
+                            object_store=f"{input_dir}_object_store" if args.object_store else None,
                         )
+                        if args.workers:
+                            # the rows are spread over the processes, one covering array after another
+                            img_composite(**kwargs, workers=args.workers)
+                        else:
+                            jobs.append(thread_pool.submit(img_composite, **kwargs))
         thread_pool.shutdown(wait=True)
+        # a failed job must not go unnoticed, the others are finished first
+        for job in jobs:
+            job.result()
@@ -5,6 +5,7 @@ import pandas as pd
 from PIL import Image
 import os.path
 import pickle
+from suite import Suite, open_image
 
 cat2idx1 = {
     "airplane": 0, "apple": 1, "backpack": 2, "banana": 3, "baseball bat": 4,
@@ -50,9 +51,14 @@ label_transform = {
 }
 
 
-def read_info_from_csv(path):
+def read_info_from_csv(path, model=None):
+    """
+    :param model: if not None and the images are shared by several models (models column), only the images of model
+    """
     infos = []
     df = pd.read_csv(path, dtype={"filename": np.str_, "labels": np.str_}, keep_default_na=False)
+    if model is not None and "models" in df.columns:
+        df = df[df["models"].map(lambda models: model in models.split("|"))]
     df.apply(lambda x: infos.append(
         [x["filename"], list(filter(None, x["labels"].split("|")))]
     ), axis=1)
@@ -60,14 +66,20 @@ def read_info_from_csv(path):
 
 
 class LvcitCoco(data.Dataset):
-    def __init__(self, root, phase="predict", transform=None, target_transform=None, inp_name=None):
+    def __init__(self, root, phase="predict", transform=None, target_transform=None, inp_name=None, model=None):
         self.root = root
         self.set = phase
         self.transform = transform
         self.target_transform = target_transform
         self.inp_name = inp_name
         self.num_classes = len(object_categories1)
-        self.images = read_info_from_csv(os.path.join(root, "info.csv"))
+        if Suite.exists(root):
+            # packed suite, see suite.py
+            self.suite = Suite(root, model)
+            self.images = [[self.suite.filename(i), self.suite.labels(i)] for i in range(len(self.suite))]
+        else:
+            self.suite = None
+            self.images = read_info_from_csv(os.path.join(root, "info.csv"), model)
 
         with open(inp_name, 'rb') as f:
             self.inp = pickle.load(f)
@@ -80,7 +92,7 @@ class LvcitCoco(data.Dataset):
     def __getitem__(self, index):
         # e.g. filename: abc.jpg, labels: ["aeroplane", "bicycle"]
         filename, labels = self.images[index]
-        img = Image.open(os.path.join(self.root, filename)).convert('RGB')
+        img = self.load_image(index)
         target = np.zeros(self.num_classes, np.float32) - 1
         target[[object_categories1.index(label) for label in labels]] = 1
         if self.transform is not None:
@@ -92,6 +104,11 @@ class LvcitCoco(data.Dataset):
     def __len__(self):
         return len(self.images)
 
+    def load_image(self, index):
+        if self.suite is not None:
+            return Image.fromarray(self.suite.image(index))
+        return open_image(os.path.join(self.root, self.images[index][0]))
+
     def get_number_classes(self):
         return self.num_classes
 
@@ -100,13 +117,13 @@ class LvcitCoco(data.Dataset):
 
 
 class LvcitCoco2(LvcitCoco):
-    def __init__(self, root, phase="predict", transform=None, target_transform=None, inp_name=None):
-        super(LvcitCoco2, self).__init__(root, phase, transform, target_transform, inp_name)
+    def __init__(self, root, phase="predict", transform=None, target_transform=None, inp_name=None, model=None):
+        super(LvcitCoco2, self).__init__(root, phase, transform, target_transform, inp_name, model)
 
     def __getitem__(self, index):
         # e.g. filename: abc.jpg, labels: ["aeroplane", "bicycle"]
         filename, labels = self.images[index]
-        img = Image.open(os.path.join(self.root, filename)).convert('RGB')
+        img = self.load_image(index)
         target = np.zeros(self.num_classes, np.float32)
         target[[object_categories2.index(label) for label in labels]] = 1
         if self.transform is not None:
@@ -4,10 +4,10 @@ import time
 import argparse
 import os
 import joblib
-import glob
 import pandas as pd
 
 from util import cal_score
+from ca_generator import CoveringArrayStore
 from default_runner import runner
 from dataloaders import *
 
@@ -210,8 +210,11 @@ def randomly_select(select_num, repeat):
                 if not os.path.exists(dst_dir):
                     os.makedirs(dst_dir)
                 print()
-                ca_path = glob.glob(os.path.join(ca_root, ca_type.split("_")[0], f"ca_{ca_type}*.csv"))[i]
-                ca_df = pd.read_csv(ca_path)
+                method, n, k, tau = ca_type.rsplit("_", 3)
+                # the imported arrays of the paper (negative seeds), which the LV-CIT images were built from
+                arrays = CoveringArrayStore(ca_root).find(method, int(n), int(k), int(tau), thr=1.0)
+                arrays = arrays[arrays["seed"] < 0].reset_index(drop=True)
+                ca_df = CoveringArrayStore.read(arrays["path"][i])
                 img_num = len(ca_df) * select_num
                 if f"{data}_{ca_type}" not in selected:
                     res = res_df.sample(img_num).reset_index(drop=True)
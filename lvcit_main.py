@@ -13,6 +13,7 @@ warnings.filterwarnings('ignore')
 # data info
 ROOT = os.path.join("data", "lvcit")
 VERSION = "_v6_random_255_255_255_255_s1a0"
+SHARED_DIR = "shared"  # composite images shared by all the models, see compositer.SHARED_DIR
 
 checkpoints_dir = "checkpoints"
 checkpoints_save_dir = os.path.join("checkpoints", "save")
@@ -165,7 +166,12 @@ if __name__ == "__main__":
         type=str2bool,
         default=False,
     )
+    parser.add_argument(
+        "--shared", type=str2bool, default=False,
+        help="test the composite images shared by all the models (compositer.py --shared) instead of one set per model"
+    )
     args = parser.parse_args()
+    shared = args.shared
     if args.demo:
         task = TASKS[0]
         task["args"]["covering_array_type"] = ["adaptive random_6_3_2"]
@@ -173,7 +179,7 @@ if __name__ == "__main__":
         start = time.time()
         args = argparse.Namespace(**task["args"])
         args.dataloader = task["dataloader"]
-        args.data = os.path.join(args.data, args.model_name)
+        args.data = os.path.join(args.data, SHARED_DIR if shared else args.model_name)
         args.res_path = os.path.join(args.res_path, args.model_name)
         try:
             runner(args, 1)
@@ -190,7 +196,7 @@ if __name__ == "__main__":
             start = time.time()
             args = argparse.Namespace(**task["args"])
             args.dataloader = task["dataloader"]
-            args.data = os.path.join(args.data, args.model_name)
+            args.data = os.path.join(args.data, SHARED_DIR if shared else args.model_name)
             args.res_path = os.path.join(args.res_path, args.model_name)
             try:
                 runner(args)
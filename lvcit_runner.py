@@ -83,7 +83,7 @@ def create_engine(model_class, args):
 
 
 def runner1(dataloader_class, model_class, args):
-    val_dataset = dataloader_class(args.data, phase=args.phase, inp_name=args.inp_name)
+    val_dataset = dataloader_class(args.data, phase=args.phase, inp_name=args.inp_name, model=args.model_name)
     model, criterion, optimizer, engine = create_engine(model_class, args)
     engine.predict(model, criterion, val_dataset, optimizer)
 
@@ -124,6 +124,7 @@ def create_loader_and_model(dataloader_class, model_class, args):
         val_dataset = dataloader_class(
             args.data, phase=args.phase,
             inp_name=args.inp_name,
+            model=args.model_name,
             transform=transforms.Compose([
                 transforms.Resize((args.image_size, args.image_size)),
                 transforms.ToTensor(),
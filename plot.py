@@ -1,7 +1,7 @@
 import pandas as pd
 import os
 import matplotlib.pyplot as plt
-import glob
+from ca_generator import CoveringArrayStore
 
 data_root = os.path.join(
     "data", "lvcit", "5res_analyse", "ca_gens"
@@ -11,23 +11,26 @@ ca_dir = os.path.join(
 )
 
 
-def load_ca_info():
+def load_ca_info(seeds=None):
+    """
+    sizes and generation times of the covering arrays of the paper
+
+    :param seeds: seeds of the arrays to average, default the arrays imported from the csv files of the paper
+    (negative seeds), so that the arrays of later sweeps are not mixed in
+    """
     ca_time_size_df = pd.DataFrame(columns=["n", "k", "tau", "method", "size", "time"])
     ca_type_name = {
         "adaptive random": "LV-CIT",
         "baseline": "Baseline"
     }
+    store = CoveringArrayStore(ca_dir)
     for ca_type in ["adaptive random", "baseline"]:
         for n in [20, 80]:
             for k in range(2, 7):
                 tau = 2
-                ca_path = glob.glob(os.path.join(
-                    ca_dir, ca_type,
-                    f"ca_{ca_type}_{n}_{k}_{tau}*.csv"
-                ))
-                for file in ca_path:
-                    ca_time = float(file.split("_")[-1].replace(".csv", ""))
-                    ca_size = int(file.split("_")[-2])
+                arrays = store.find(ca_type, n, k, tau, thr=1.0)
+                arrays = arrays[arrays["seed"] < 0] if seeds is None else arrays[arrays["seed"].isin(seeds)]
+                for ca_size, ca_time in arrays[["size", "time"]].values:
                     ca_time_size_df.loc[len(ca_time_size_df)] = [n, k, tau, ca_type_name[ca_type], ca_size, ca_time]
     acts_file = os.path.join(ca_dir, "ca_acts_info.csv")
     acts_df = pd.read_csv(acts_file)
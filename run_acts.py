@@ -6,6 +6,7 @@ import pandas as pd
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 import time
+from ca_generator import Constraints
 
 
 args_template = Template("""
@@ -20,15 +21,57 @@ $constraint
 """)
 
 
-def generate_args():
+def acts_constraints(constraints: Constraints):
+    """
+    the forbidden label sets and the implications in ACTS syntax, the label frequencies can not be expressed
+    """
+    lines = ["!(" + " && ".join([f"P{i + 1}=1" for i in labels]) + ")" for labels in constraints.forbidden]
+    lines += [f"P{a + 1}=1 => P{b + 1}=1" for a, b in constraints.implies]
+    return lines
+
+
+def write_args(n, k, path, constraints=None):
+    """
+    write the ACTS system file of n binary labels with at most k labels in a row
+
+    :param constraints: path of the constraints json file (see ca_generator.Constraints.load), default only the
+    counting constraint
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    constraint = "+".join([f"P{i}" for i in range(1, n + 1)]) + f"<={k}"
+    if constraints:
+        constraint = "\n".join([constraint] + acts_constraints(Constraints.load(constraints, n, k)))
+    parameters = "\n".join([f"P{i} (int) : 0, 1" for i in range(1, n + 1)])
+    args = args_template.substitute(name=name, parameters=parameters, constraint=constraint)
+    with open(path, "w") as f:
+        f.write(args)
+
+
+def generate_args(constraints=None):
+    """
+    :param constraints: path of the constraints json file (see ca_generator.Constraints.load), default only the
+    counting constraint
+    """
     for n in [20, 80]:
         for k in range(2, 7):
-            name = f"args_{n}_{k}"
-            constraint = "+".join([f"P{i}" for i in range(1, n + 1)]) + f"<={k}"
-            parameters = "\n".join([f"P{i} (int) : 0, 1" for i in range(1, n + 1)])
-            args = args_template.substitute(name=name, parameters=parameters, constraint=constraint)
-            with open(os.path.join("args", f"{name}.txt"), "w") as f:
-                f.write(args)
+            write_args(n, k, os.path.join("args", f"args_{n}_{k}.txt"), constraints)
+
+
+def acts_command(args_file, output_file, tau, jar="acts_3.2.jar"):
+    return [
+        "java", f"-Ddoi={tau}", "-Doutput=csv", "-Dchandler=solver", "-Dprogress=on", "-Drandstar=on",
+        "-jar", jar, args_file, output_file
+    ]
+
+
+def parse_acts_output(output):
+    """
+    :return: size of the covering array and time cost reported by ACTS, 0, 0 if not found
+    """
+    info = re.search(r"Number of Tests\t: (\d+)\nTime \(seconds\)\t: ([\d\.]+)", output)
+    if info:
+        return info.group(1), info.group(2)
+    return 0, 0
 
 
 complete_info = pd.DataFrame(columns=["k", "20-2", "80-2"])
@@ -59,18 +102,14 @@ def run_acts(n, k, tau, i):
     update_complete_info(n, k, tau, i, 0)
     args_file = os.path.join("args", f"args_{n}_{k}.txt")
     output_file = os.path.join("res", f"ca_acts_{n}_{k}_{tau}_{i}.csv")
-    command = ["java", f"-Ddoi={tau}", "-Doutput=csv", "-Dchandler=solver", "-Dprogress=on", "-Drandstar=on", "-jar", "acts_3.2.jar", args_file, output_file]
-    process = subprocess.run(command, capture_output=True, text=True)
+    process = subprocess.run(acts_command(args_file, output_file, tau), capture_output=True, text=True)
     ca_size, ca_time = 0, 0
     if process.returncode == 0:
         output = process.stdout.strip()
         if output:
             with open(os.path.join("logs", f"ca_acts_{n}_{k}_{tau}_{i}.log"), "w") as f:
                 f.write(output)
-            info = re.search(r"Number of Tests\t: (\d+)\nTime \(seconds\)\t: ([\d\.]+)", output)
-            if info:
-                ca_size = info.group(1)
-                ca_time = info.group(2)
+            ca_size, ca_time = parse_acts_output(output)
         else:
             error = process.stderr.strip()
             if error:
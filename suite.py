@@ -0,0 +1,183 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import cv2
+from PIL import Image
+
+SUITE_PIXELS = "suite.bin"
+SUITE_INDEX = "suite_index.npz"
+
+
+class SuiteWriter:
+    """
+    writer of a packed test suite: the RGB pixels of all images are appended to one flat uint8 shard (suite.bin),
+    their names, offsets, shapes, labels (a bitmask over the classes) and models are written to suite_index.npz
+    when the writer is closed, a suite without index is incomplete
+
+    :param root: directory of the suite
+    :param classes: names of the labels of the bitmask, default the sorted labels of the images
+    """
+
+    def __init__(self, root, classes=None):
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.root = root
+        self.classes = classes
+        self.filenames, self.shapes, self.labels, self.models = [], [], [], []
+        self.offsets = [0]
+        self.file = open(os.path.join(root, SUITE_PIXELS), "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, filename, img, labels, models=None):
+        """
+        :param filename: name of the image
+        :param img: (h, w, 3) uint8 RGB image
+        :param labels: label names of the image
+        :param models: "|" joined models of the image, see compositer.img_composite
+        """
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        self.file.write(img.data)
+        self.filenames.append(filename)
+        self.shapes.append(img.shape)
+        self.labels.append(list(labels))
+        self.models.append(models)
+        self.offsets.append(self.offsets[-1] + img.size)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        classes = self.classes if self.classes is not None else sorted({l for labels in self.labels for l in labels})
+        ids = {label: i for i, label in enumerate(classes)}
+        bits = np.zeros((len(self.labels), len(classes)), dtype=bool)
+        for i, labels in enumerate(self.labels):
+            bits[i, [ids[label] for label in labels]] = True
+        index = dict(
+            filenames=np.array(self.filenames, dtype=str),
+            offsets=np.array(self.offsets, dtype=np.int64),
+            shapes=np.array(self.shapes, dtype=np.int64).reshape(-1, 3),
+            classes=np.array(classes, dtype=str),
+            labels=np.packbits(bits, axis=1),
+        )
+        if any(models is not None for models in self.models):
+            index["models"] = np.array(["" if models is None else models for models in self.models], dtype=str)
+        np.savez(os.path.join(self.root, SUITE_INDEX), **index)
+
+
+class Suite:
+    """
+    packed test suite written by SuiteWriter, the shard is memory-mapped (copy-on-write, so the views are writable
+    without touching the file) when an image is first read, in every process that reads it
+
+    :param root: directory of the suite
+    :param model: if not None and the images are tagged with models, only the images of model
+    """
+
+    def __init__(self, root, model=None):
+        self.root = root
+        with np.load(os.path.join(root, SUITE_INDEX)) as index:
+            self.filenames = index["filenames"]
+            self.offsets = index["offsets"]
+            self.shapes = index["shapes"]
+            self.classes = index["classes"].tolist()
+            self.bits = np.unpackbits(index["labels"], axis=1, count=len(self.classes)).astype(bool)
+            self.models = index["models"] if "models" in index.files else None
+        self.ids = np.arange(len(self.filenames))
+        if model is not None and self.models is not None:
+            self.ids = self.ids[[model in models.split("|") for models in self.models]]
+        self._pixels = None
+
+    @staticmethod
+    def exists(root):
+        return os.path.exists(os.path.join(root, SUITE_INDEX))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # worker processes map the shard again instead of receiving a copy of it
+        return {**self.__dict__, "_pixels": None}
+
+    @property
+    def pixels(self):
+        if self._pixels is None:
+            self._pixels = np.memmap(os.path.join(self.root, SUITE_PIXELS), dtype=np.uint8, mode="c")
+        return self._pixels
+
+    def image(self, index):
+        """
+        :return: (h, w, 3) RGB view of the shard
+        """
+        i = self.ids[index]
+        return self.pixels[self.offsets[i]:self.offsets[i + 1]].reshape(self.shapes[i])
+
+    def filename(self, index):
+        return str(self.filenames[self.ids[index]])
+
+    def labels(self, index):
+        return [self.classes[j] for j in np.flatnonzero(self.bits[self.ids[index]])]
+
+    def targets(self, categories, negative=0):
+        """
+        :param categories: label names in the order of the targets
+        :param negative: value of the absent labels
+        :return: (n, len(categories)) float32 targets of the images
+        """
+        columns = [categories.index(label) for label in self.classes]
+        targets = np.full((len(self.ids), len(categories)), negative, dtype=np.float32)
+        rows, labels = np.nonzero(self.bits[self.ids])
+        targets[rows, np.array(columns, dtype=np.int64)[labels]] = 1
+        return targets
+
+
+def read_image(path):
+    """
+    :return: (h, w, 3) RGB image of a png/webp/npy file of the compositer
+    """
+    if path.endswith(".npy"):
+        return np.load(path)
+    return cv2.cvtColor(cv2.imread(path, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+
+
+def open_image(path):
+    """
+    :return: RGB PIL image of a png/webp/npy file of the compositer, the raw .npy images need no decoding
+    """
+    if path.endswith(".npy"):
+        return Image.fromarray(np.load(path))
+    return Image.open(path).convert("RGB")
+
+
+def convert(directory, classes=None):
+    """
+    pack a directory of composite images (info.csv and the image files) into a suite in the same directory, the
+    components directory is packed too if any
+
+    :param classes: see SuiteWriter
+    :return: number of images
+    """
+    info = pd.read_csv(os.path.join(directory, "info.csv"), dtype=str, keep_default_na=False)
+    with SuiteWriter(directory, classes) as writer:
+        for row in info.to_dict("records"):
+            writer.add(
+                row["filename"], read_image(os.path.join(directory, row["filename"])),
+                filter(None, row["labels"].split("|")), row.get("models"),
+            )
+    if os.path.exists(os.path.join(directory, "components", "info.csv")):
+        convert(os.path.join(directory, "components"), classes)
+    return len(info)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pack directories of composite images into suites")
+    parser.add_argument("directories", nargs="+", help="directories with an info.csv")
+    args = parser.parse_args()
+    for directory in args.directories:
+        n = convert(directory)
+        print(f"{directory}: {n} images packed into {os.path.join(directory, SUITE_PIXELS)}")